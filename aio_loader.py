@@ -0,0 +1,246 @@
+""" aio_loader.py
+
+Asyncio counterparts of `zid_project2.read_prc_csv`, `zid_project2.mk_prc_df`
+and `zid_project1.read_dat`
+
+Files are read and parsed in an executor (a thread pool by default), so the
+event loop is never blocked. An `AsyncLoader` limits the number of loads
+running at the same time with a semaphore, and concurrent requests for the
+same data (e.g. the same ticker) share a single in-flight load instead of
+each reading the file again. Once a load finishes, the next request reads
+the file again (use `memo` or `prc_cache` for caching).
+
+Example
+-------
+    >> loader = AsyncLoader(max_concurrency=8)
+    >> prc_df = await loader.mk_prc_df(['aapl', 'tsla'])
+
+Notes
+-----
+Requests that share a load receive the same object: copy it before
+modifying it.
+
+"""
+import os
+import sys
+import asyncio
+import weakref
+import functools
+
+ROOTDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOTDIR, 'project2'))
+
+import pandas as pd
+
+from project1 import zid_project1 as zp1
+import zid_project2 as zp2
+
+
+# Default maximum number of loads running at the same time
+MAX_CONCURRENCY = 8
+
+
+def _date_key(date):
+    """ Returns `date` as a Timestamp (or None), so that equal dates given as
+    strings or Timestamps share the same in-flight load
+    """
+    return None if date is None else pd.Timestamp(date)
+
+
+class AsyncLoader:
+    """ Loads price files without blocking the event loop
+
+    Parameters
+    ----------
+    max_concurrency : int, optional
+        Maximum number of files read at the same time. Defaults to
+        `MAX_CONCURRENCY`.
+
+    executor : Executor, optional
+        Executor where files are read and parsed. Defaults to None (the
+        default executor of the event loop, a thread pool).
+
+    Attributes
+    ----------
+    loads : int
+        Number of loads run in the executor (requests that shared an
+        in-flight load are not counted)
+
+    Notes
+    -----
+    A loader can be used in any number of event loops (e.g. successive
+    `asyncio.run` calls). The concurrency limit and the sharing of in-flight
+    loads apply to each event loop separately.
+
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, executor=None):
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.loads = 0
+        # {<loop> : (<semaphore>, <in-flight tasks>)}. A semaphore and a task
+        # can only be used in the event loop where they were first used. The
+        # entry of a loop is removed when its last load finishes (a semaphore
+        # that was waited on holds a reference to its loop, so the weak key
+        # alone would keep the entry alive).
+        self._state = weakref.WeakKeyDictionary()
+
+    def _loop_state(self):
+        """ Returns the semaphore and the dictionary of in-flight tasks of
+        the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        state = self._state.get(loop)
+        if state is None:
+            state = self._state[loop] = (asyncio.Semaphore(self.max_concurrency), {})
+        return state
+
+    async def _load(self, func, *args, **kwargs):
+        """ Runs `func(*args, **kwargs)` in the executor once a slot is free
+        """
+        sem, _ = self._loop_state()
+        async with sem:
+            self.loads += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _shared(self, key, func, *args, **kwargs):
+        """ Returns the result of `func(*args, **kwargs)`, joining the load
+        in flight for `key` if there is one
+        """
+        _, inflight = self._loop_state()
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(func, *args, **kwargs))
+            inflight[key] = task
+            task.add_done_callback(functools.partial(
+                self._done, asyncio.get_running_loop(), key))
+        # A cancelled request must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    def _done(self, loop, key, task):
+        """ Removes the finished load `key` and, if no other load is in
+        flight (so no task holds or waits on the semaphore), the state of
+        `loop`
+        """
+        state = self._state.get(loop)
+        if state is None:
+            return
+        inflight = state[1]
+        if inflight.get(key) is task:
+            del inflight[key]
+        if not inflight:
+            del self._state[loop]
+
+    async def read_prc_csv(self, tic, start=None, end=None, columns=None):
+        """ Async version of `zid_project2.read_prc_csv`
+        """
+        tic = tic.lower()
+        cols_key = None if columns is None else tuple(columns)
+        key = ('read_prc_csv', tic, _date_key(start), _date_key(end), cols_key)
+        return await self._shared(key, zp2.read_prc_csv, tic, start=start, end=end,
+                                  columns=columns)
+
+    async def mk_prc_df(self, tickers, prc_col='adj_close', start=None, end=None):
+        """ Async version of `zid_project2.mk_prc_df`. The tickers are read
+        concurrently (at most `max_concurrency` at a time).
+        """
+        tickers = [tic.lower() for tic in tickers]
+        if not tickers:
+            return pd.DataFrame()
+        dfs = await asyncio.gather(*(
+            self.read_prc_csv(tic, start=start, end=end, columns=[prc_col]) for tic in tickers))
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self.executor, zp2._combine, tickers, list(dfs), [prc_col])
+        return result[prc_col]
+
+    async def read_dat(self, tic, start=None, end=None):
+        """ Async version of `zid_project1.read_dat`
+        """
+        key = ('read_dat', tic, _date_key(start), _date_key(end))
+        return await self._shared(key, zp1.read_dat, tic, start, end)
+
+
+_LOADER = None
+
+
+def get_loader():
+    """ Returns the default `AsyncLoader`
+    """
+    global _LOADER
+    if _LOADER is None:
+        _LOADER = AsyncLoader()
+    return _LOADER
+
+
+async def read_prc_csv(tic, start=None, end=None, columns=None):
+    """ `AsyncLoader.read_prc_csv` with the default loader
+    """
+    return await get_loader().read_prc_csv(tic, start=start, end=end, columns=columns)
+
+
+async def mk_prc_df(tickers, prc_col='adj_close', start=None, end=None):
+    """ `AsyncLoader.mk_prc_df` with the default loader
+    """
+    return await get_loader().mk_prc_df(tickers, prc_col=prc_col, start=start, end=end)
+
+
+async def read_dat(tic, start=None, end=None):
+    """ `AsyncLoader.read_dat` with the default loader
+    """
+    return await get_loader().read_dat(tic, start=start, end=end)
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_aio_loader():
+    """ Sends many concurrent requests (with repeated tickers) and checks that
+    each ticker is loaded once and that the results match the synchronous
+    functions
+    """
+    import time
+    import config as cfg
+
+    tickers = [tic.lower() for tic in cfg.TICKERS]
+
+    async def requests(loader):
+        # 5 requests per ticker, interleaved
+        reqs = [loader.read_prc_csv(tic) for _ in range(5) for tic in tickers]
+        dats = [loader.read_dat(tic) for tic in ['aapl', 'aapl', 'tsla']]
+        res = await asyncio.gather(*reqs, *dats)
+        return res[:len(reqs)], res[len(reqs):]
+
+    loader = AsyncLoader(max_concurrency=4)
+    start = time.perf_counter()
+    dfs, dats = asyncio.run(requests(loader))
+    print(f'{len(dfs) + len(dats)} requests, {loader.loads} loads '
+          f'in {time.perf_counter() - start:.3f} s')
+    same = all(df.equals(zp2.read_prc_csv(tic)) for df, tic in zip(dfs, tickers * 5))
+    print(f'Same as read_prc_csv: {same}')
+    print(f"Same as read_dat: {dats[0] == zp1.read_dat('aapl')}")
+    print(f'No event loop state left: {len(loader._state) == 0}')
+
+    async def dates(loader):
+        return await asyncio.gather(
+            loader.read_prc_csv('aapl', start='2020-01-01'),
+            loader.read_prc_csv('aapl', start=pd.Timestamp('2020-01-01')))
+
+    loads = loader.loads
+    df1, df2 = asyncio.run(dates(loader))
+    print(f'String and Timestamp dates share a load: {loader.loads - loads == 1 and df1 is df2}')
+
+    prc_df = asyncio.run(mk_prc_df(tickers, start='2010-01-01'))
+    print(f"Same as mk_prc_df: {prc_df.equals(zp2.mk_prc_df(tickers, start='2010-01-01'))}")
+
+    # The same loader in a second event loop, with more requests than slots
+    loads = loader.loads
+    dfs, _ = asyncio.run(requests(loader))
+    print(f'Second event loop: {loader.loads - loads} loads, '
+          f'same results: {all(df.equals(zp2.read_prc_csv(tic)) for df, tic in zip(dfs, tickers * 5))}')
+    print(f'No event loop state left: {len(loader._state) == 0}')
+
+
+if __name__ == "__main__":
+    _test_aio_loader()
@@ -0,0 +1,390 @@
+""" bench.py
+
+Benchmark suite for the public functions in `project1` and `project2`
+
+Each dataset is laid out in a temporary folder (with a ".dat" file per ticker,
+a tickers file, a "<tic>_prc.csv" file per ticker and "ff_daily.csv") and the
+modules are pointed at it, so every dataset is benchmarked with exactly the
+same code paths. The datasets are:
+    - 'small': 3 tickers from the shipped data
+    - 'full': all the shipped tickers
+    - 'synthetic': 1000 tickers with 21 years of history, created by
+      `synthetic.generate` (the same files on every run)
+
+Results are saved as JSON together with the commit, the library versions and
+the machine, so runs on different commits can be compared:
+
+    python bench.py --dataset small full --out base.json
+    (checkout another commit, copying bench.py into it if needed)
+    python bench.py --dataset small full --out new.json
+    python bench.py --compare base.json new.json
+
+Only the public functions of `zid_project1` and `zid_project2` are timed, and
+they are called as in the original projects, so the suite also runs on
+commits that only have these two modules. Modules that older commits do not
+have (`prc_cache`, `prc_files`, `synthetic`) are optional: without them, the
+benchmarks and datasets that need them are skipped.
+
+`toolkit_config` (with `PRJDIR`) must be importable, as for the projects.
+
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+ROOTDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOTDIR, 'project2'))
+
+import numpy as np
+import pandas as pd
+
+from project1 import zid_project1 as zp1
+import config as cfg
+import zid_project2 as zp2
+
+try:
+    import prc_cache
+    import prc_files
+except ImportError:
+    prc_cache = prc_files = None
+
+try:
+    import synthetic
+except ImportError:
+    synthetic = None
+
+
+DATASETS = ['small', 'full', 'synthetic']
+
+SMALL_TICKERS = ['aapl', 'tsla', 'fb']
+
+SYNTHETIC_NTICS = 1000
+
+# Relative change in the median time above which `compare` reports a
+# regression
+THRESHOLD = 0.10
+
+
+def _shipped_tickers():
+    """ Returns the tickers with both a ".dat" and a CSV file in the shipped
+    data
+    """
+    dat = {name[:-len('_prc.dat')] for name in os.listdir(zp1.DATDIR)
+           if name.endswith('_prc.dat')}
+    csv = {name[:-len('_prc.csv')] for name in os.listdir(cfg.DATADIR)
+           if name.endswith('_prc.csv')}
+    return sorted(dat & csv)
+
+
+def _link(src, dst):
+    """ Creates `dst` as a symbolic link to `src` (or a copy, if links are
+    not supported)
+    """
+    try:
+        os.symlink(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def mk_dataset(name, dst):
+    """ Lays out the dataset `name` in the folder `dst`
+
+    Parameters
+    ----------
+    name : str
+        One of `DATASETS`
+
+    dst : str
+        Existing (empty) folder
+
+    Returns
+    -------
+    dict
+        A dictionary with the tickers ('tickers') and the locations of the
+        ".dat" folder ('datdir'), the tickers file ('ticpath'), the CSV
+        folder ('datadir') and the cache folder ('cachedir')
+    """
+    if name == 'small':
+        sources = {tic: tic for tic in SMALL_TICKERS}
+    elif name == 'full':
+        sources = {tic: tic for tic in _shipped_tickers()}
+    elif name == 'synthetic':
+        if synthetic is None:
+            msg = "The 'synthetic' dataset needs the `synthetic` module"
+            raise Exception(msg)
+        ds = synthetic.generate(dst, ntics=SYNTHETIC_NTICS, seed=0)
+        ds['cachedir'] = os.path.join(dst, 'cache')
+        return ds
+    else:
+        msg = f"Unknown dataset '{name}'. Must be one of {DATASETS}"
+        raise Exception(msg)
+
+    ds = {
+        'tickers': list(sources),
+        'datdir': os.path.join(dst, 'dat'),
+        'ticpath': os.path.join(dst, 'tickers.txt'),
+        'datadir': os.path.join(dst, 'csv'),
+        'cachedir': os.path.join(dst, 'cache'),
+        }
+    os.makedirs(ds['datdir'])
+    os.makedirs(ds['datadir'])
+    for tic, src in sources.items():
+        _link(os.path.join(zp1.DATDIR, f'{src}_prc.dat'), os.path.join(ds['datdir'], f'{tic}_prc.dat'))
+        _link(os.path.join(cfg.DATADIR, f'{src}_prc.csv'), os.path.join(ds['datadir'], f'{tic}_prc.csv'))
+    _link(cfg.FF_CSV, os.path.join(ds['datadir'], 'ff_daily.csv'))
+    with open(ds['ticpath'], 'w') as fobj:
+        fobj.write('\n'.join(tic.upper() for tic in sources) + '\n')
+    return ds
+
+
+@contextlib.contextmanager
+def use_dataset(ds):
+    """ Points `zid_project1`, `config` and `prc_files` (if available) at
+    the dataset `ds` (see `mk_dataset`) while the context is active
+    """
+    values = [
+        (zp1, 'DATDIR', ds['datdir']),
+        (zp1, 'TICPATH', ds['ticpath']),
+        (cfg, 'DATADIR', ds['datadir']),
+        (cfg, 'FF_CSV', os.path.join(ds['datadir'], 'ff_daily.csv')),
+        ]
+    if prc_files is not None:
+        values.append((prc_files, 'CACHEDIR', ds['cachedir']))
+    saved = [(mod, attr, getattr(mod, attr)) for mod, attr, _ in values]
+    try:
+        for mod, attr, value in values:
+            setattr(mod, attr, value)
+        yield ds
+    finally:
+        for mod, attr, value in saved:
+            setattr(mod, attr, value)
+
+
+def _no_cache(func):
+    """ Returns `func` wrapped so that it runs with `prc_cache` disabled
+    """
+    def wrapper():
+        enabled, prc_cache.ENABLED = prc_cache.ENABLED, False
+        try:
+            return func()
+        finally:
+            prc_cache.ENABLED = enabled
+    return wrapper
+
+
+def mk_benchmarks(ds, tmpdir):
+    """ Returns a dictionary with format {<name> : (<func>, <n>)}, where
+    <func> takes no arguments and <n> is the number of items it processes
+    (e.g. lines or tickers)
+
+    Inputs that are not being measured (e.g. the price data frame used by
+    `mk_ret_df`) are created here, once.
+    """
+    tics = ds['tickers']
+    first = tics[0]
+    lines = zp1.read_dat(first)
+    nlines = sum(len(zp1.read_dat(tic)) for tic in tics)
+    csvloc = os.path.join(tmpdir, 'main.csv')
+
+    # Fill the cache (if any), so `read_prc_csv` is measured warm
+    for tic in tics:
+        zp2.read_prc_csv(tic)
+    prc_df = zp2.mk_prc_df(tics)
+    ret_df = zp2.mk_ret_df(prc_df)
+    cols = [tic for tic in tics if tic in ret_df.columns]
+    years = sorted(set(ret_df.index.year))
+    year = years[-2] if len(years) > 1 else years[-1]
+    # `get_ann_ret` needs at least one return in the period (synthetic
+    # tickers can be delisted before it starts)
+    start, end = '2010-01-01', '2020-12-31'
+    ann_cols = [tic for tic in cols if ret_df[tic].loc[start:end].notna().any()]
+
+    benchmarks = {
+        'project1.get_tics': (lambda: zp1.get_tics(ds['ticpath']), len(tics)),
+        'project1.read_dat': (lambda: [zp1.read_dat(tic) for tic in tics], nlines),
+        'project1.line_to_dict': (lambda: [zp1.line_to_dict(line) for line in lines], len(lines)),
+        'project1.main': (lambda: zp1.main(csvloc, replace=True), nlines),
+        'project2.read_prc_csv': (lambda: [zp2.read_prc_csv(tic) for tic in tics], len(tics)),
+        'project2.mk_prc_df': (lambda: zp2.mk_prc_df(tics), len(tics)),
+        'project2.mk_ret_df': (lambda: zp2.mk_ret_df(prc_df), prc_df.size),
+        'project2.mk_aret_df': (lambda: zp2.mk_aret_df(ret_df), ret_df.size),
+        'project2.get_avg': (lambda: [zp2.get_avg(ret_df, tic, year) for tic in cols], len(cols)),
+        'project2.get_ew_rets': (lambda: zp2.get_ew_rets(ret_df, cols), ret_df.size),
+        'project2.get_ann_ret': (
+            lambda: [zp2.get_ann_ret(ret_df[tic], start, end) for tic in ann_cols],
+            len(ann_cols)),
+        }
+    if prc_cache is not None:
+        benchmarks['project2.read_prc_csv[no_cache]'] = (
+            _no_cache(lambda: [zp2.read_prc_csv(tic) for tic in tics]), len(tics))
+    return benchmarks
+
+
+def time_func(func, repeat=5, warmup=1):
+    """ Returns a list with the time (in seconds) of `repeat` calls to
+    `func`, after `warmup` calls that are not measured
+    """
+    for _ in range(warmup):
+        func()
+    result = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def _git_commit():
+    """ Returns the current commit of the repository, or None
+    """
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOTDIR,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(datasets=None, repeat=5, warmup=1, only=None):
+    """ Runs the benchmarks on each dataset
+
+    Parameters
+    ----------
+    datasets : list, optional
+        Datasets from `DATASETS`. Defaults to ['small', 'full'].
+
+    repeat : int, optional
+        Number of measured calls of each benchmark. Defaults to 5.
+
+    warmup : int, optional
+        Number of calls before the measured ones. Defaults to 1.
+
+    only : list, optional
+        If given, only the benchmarks whose name contains one of these
+        strings are run
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys
+        - 'meta': commit, library versions and machine
+        - 'results': dictionary with format {<dataset>/<name> : <res>},
+          where <res> has the number of items ('n'), the times of each call
+          ('runs') and their 'min', 'median' and 'mean'
+    """
+    if datasets is None:
+        datasets = ['small', 'full']
+    meta = {
+        'commit': _git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'warmup': warmup,
+        }
+    results = {}
+    for name in datasets:
+        if name == 'synthetic' and synthetic is None:
+            print(f"Skipping '{name}': the `synthetic` module is not available", file=sys.stderr)
+            continue
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ds = mk_dataset(name, tmpdir)
+            with use_dataset(ds):
+                benchmarks = mk_benchmarks(ds, tmpdir)
+                for bench, (func, n) in benchmarks.items():
+                    if only and not any(s in bench for s in only):
+                        continue
+                    runs = time_func(func, repeat=repeat, warmup=warmup)
+                    key = f'{name}/{bench}'
+                    results[key] = {
+                        'n': int(n),
+                        'runs': runs,
+                        'min': min(runs),
+                        'median': statistics.median(runs),
+                        'mean': statistics.mean(runs),
+                        }
+                    print(f'{key:<45} {results[key]["median"] * 1000:10.2f} ms', file=sys.stderr)
+    return {'meta': meta, 'results': results}
+
+
+def compare(base, new, threshold=THRESHOLD):
+    """ Compares two outputs of `run`, printing the median time of each
+    benchmark in both and the ratio new / base
+
+    Parameters
+    ----------
+    base, new : dict
+        Outputs of `run` (e.g. loaded from the JSON files)
+
+    threshold : float, optional
+        Relative increase in the median time reported as a regression.
+        Defaults to `THRESHOLD`.
+
+    Returns
+    -------
+    list
+        Names of the benchmarks that regressed
+    """
+    print(f"base: {base['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+    regressions = []
+    for key, res in new['results'].items():
+        old = base['results'].get(key)
+        if old is None:
+            print(f'{key:<45} {"":>10}    {res["median"] * 1000:10.2f} ms  (new)')
+            continue
+        ratio = res['median'] / old['median'] if old['median'] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f'{key:<45} {old["median"] * 1000:10.2f} -> {res["median"] * 1000:10.2f} ms'
+              f'  {ratio:6.2f}x{flag}')
+    return regressions
+
+
+def _main(argv=None):
+    """ Command line entry point (see the module docstring)
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks for project1 and project2')
+    parser.add_argument('--dataset', nargs='+', default=['small', 'full'], choices=DATASETS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--only', nargs='+', help='Only run benchmarks containing these strings')
+    parser.add_argument('--out', help='JSON file with the results (printed if not given)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='Compare two JSON files instead of running the benchmarks')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as fobj:
+            base = json.load(fobj)
+        with open(args.compare[1]) as fobj:
+            new = json.load(fobj)
+        return 1 if compare(base, new, args.threshold) else 0
+
+    res = run(args.dataset, repeat=args.repeat, warmup=args.warmup, only=args.only)
+    text = json.dumps(res, indent=2)
+    if args.out:
+        with open(args.out, 'w') as fobj:
+            fobj.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
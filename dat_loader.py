@@ -0,0 +1,188 @@
+""" dat_loader.py
+
+Direct loader from the ".dat" files of project1 to project2 data frames
+
+`read_prc_dat` returns the data frame that `zid_project2.read_prc_csv`
+returns for the same ticker, built in a single pass from the fixed-width
+bytes (see `zid_project1.read_dat_cols`) instead of writing a text CSV with
+`zid_project1.main` and parsing it again. With `cache=True`, the result is
+also saved in the binary cache of project2 (see `prc_cache.read_file`), so
+later reads (including of a date range or a subset of the columns) come
+from the cache.
+
+Notes
+-----
+The ".dat" files do not include the 'Low' column, and their values are
+truncated to the width of each column (e.g. 'Open' has only 6 characters),
+so prices can differ from the CSV files in the last digits. A few ".dat"
+files also miss days that are in the CSV files.
+
+"""
+import os
+import sys
+
+ROOTDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOTDIR, 'project2'))
+
+import numpy as np
+import pandas as pd
+
+from project1 import zid_project1 as zp1
+import config as cfg
+import prc_cache
+import zid_project2 as zp2
+
+
+# Unit of the DatetimeIndex created by `pd.read_csv` (and so by
+# `read_prc_csv`)
+_DATE_UNIT = np.datetime_data(pd.DatetimeIndex(['2000-01-01']).dtype)[0]
+
+
+def dat_path(tic):
+    """ Returns the location of the ".dat" file for `tic`
+    """
+    return os.path.join(zp1.DATDIR, f'{tic.lower()}_prc.dat')
+
+
+def cols_to_df(cols):
+    """ Converts the output of `zid_project1.dat_to_cols` into a data frame
+    formatted as the output of `zid_project2.read_prc_csv`
+
+    Parameters
+    ----------
+    cols : dict
+        A dictionary with format {<col> : <array>}
+
+    Returns
+    -------
+    df
+        A data frame with a DatetimeIndex named 'date' and the columns
+        standardised by `cfg.standardise_colnames`, in the order of the CSV
+        files ('open', 'high', 'close', 'adj_close', 'volume')
+    """
+    index = pd.DatetimeIndex(cols['Date'].astype(f'M8[{_DATE_UNIT}]'), name='date')
+    df = pd.DataFrame({col: arr for col, arr in cols.items() if col != 'Date'}, index=index)
+    df = cfg.standardise_colnames(df)
+    order = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+    return df[[col for col in order if col in df.columns]]
+
+
+def _parse_dat(pth):
+    """ Returns the data frame for the whole ".dat" file `pth`
+    """
+    with open(pth, 'rb') as fobj:
+        data = fobj.read()
+    if len(data) % (zp1.LINEWIDTH + 1) != 0:
+        # Last line without a newline
+        data += b'\n'
+    return cols_to_df(zp1.dat_to_cols(data))
+
+
+def read_prc_dat(tic, start=None, end=None, columns=None, cache=False):
+    """ Returns a data frame with the contents of the ".dat" file for `tic`,
+    formatted as the output of `zid_project2.read_prc_csv` (see the notes in
+    the module docstring)
+
+    Parameters
+    ----------
+    tic : str
+        Ticker (can include lowercase and/or uppercase characters)
+
+    start, end : str, optional
+        Dates ('YYYY-MM-DD') of the first and last rows. Only the lines in
+        this range are read (see `zid_project1.iter_dat`).
+
+    columns : list, optional
+        Columns to return (standardised names). Defaults to all columns.
+
+    cache : bool, optional
+        If True, the whole file is saved in (or read from) the binary cache
+        in `prc_files.CACHEDIR`. Defaults to False.
+
+    Returns
+    -------
+    df
+    """
+    if cache:
+        return prc_cache.read_file(dat_path(tic), _parse_dat, start, end, columns)
+
+    tic = tic.lower()
+    df = cols_to_df(zp1.read_dat_cols(tic, start, end))
+    if columns is not None:
+        prc_cache._check_columns(dat_path(tic), columns, list(df.columns))
+        df = df[columns]
+    return df
+
+
+def mk_prc_df_dat(tickers, prc_col='adj_close', start=None, end=None, cache=False):
+    """ Same as `zid_project2.mk_prc_df`, reading the ".dat" files with
+    `read_prc_dat`
+    """
+    tickers = [tic.lower() for tic in tickers]
+    if not tickers:
+        return pd.DataFrame()
+    dfs = [read_prc_dat(tic, start=start, end=end, columns=[prc_col], cache=cache)
+           for tic in tickers]
+    return zp2._combine(tickers, dfs, [prc_col])[prc_col]
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_read_prc_dat():
+    """ Compares `read_prc_dat` with `read_prc_csv` for every ticker with both
+    files, and prints the time it takes to load all the ".dat" files directly,
+    from the cache and through `zid_project1.main` plus `pd.read_csv`
+    """
+    import time
+    import tempfile
+
+    tics = sorted(name[:-len('_prc.dat')] for name in os.listdir(zp1.DATDIR)
+                  if name.endswith('_prc.dat'))
+    same = True
+    for tic in tics:
+        dat = read_prc_dat(tic)
+        csv = zp2.read_prc_csv(tic)[dat.columns].sort_index()
+        # Some ".dat" files miss days that are in the CSV files
+        missing = csv.index.difference(dat.index)
+        if len(missing) > 0:
+            print(f"{tic}: {len(missing)} dates not in the .dat file ({missing[0]:%Y-%m-%d}, ...)")
+        same &= dat.index.difference(csv.index).empty
+        csv = csv.loc[dat.index]
+        same &= np.array_equal(dat['volume'], csv['volume'])
+        # 'Open' has only 6 characters in the ".dat" files
+        same &= bool(np.allclose(dat, csv, rtol=1e-4, atol=1e-4))
+        same &= read_prc_dat(tic, cache=True).equals(dat)
+        rng = read_prc_dat(tic, '2015-01-01', '2015-12-31', ['close'], cache=True)
+        same &= rng.equals(dat.loc['2015-01-01':'2015-12-31', ['close']])
+    print(f'Same as read_prc_csv (up to truncation) for {len(tics)} tickers: {same}')
+
+    start = time.perf_counter()
+    for tic in tics:
+        read_prc_dat(tic)
+    print(f'read_prc_dat:             {time.perf_counter() - start:.3f} s')
+
+    start = time.perf_counter()
+    for tic in tics:
+        read_prc_dat(tic, cache=True)
+    print(f'read_prc_dat (cache):     {time.perf_counter() - start:.3f} s')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ticpath, zp1.TICPATH = zp1.TICPATH, os.path.join(tmpdir, 'tickers.txt')
+        try:
+            with open(zp1.TICPATH, 'w') as fobj:
+                fobj.write('\n'.join(tics))
+            start = time.perf_counter()
+            csvloc = os.path.join(tmpdir, 'data.csv')
+            zp1.main(csvloc)
+            df = pd.read_csv(csvloc, parse_dates=['Date'])
+            # One data frame per ticker, as `read_prc_dat` returns
+            dfs = dict(iter(df.groupby('Ticker')))
+            print(f'main + pd.read_csv:       {time.perf_counter() - start:.3f} s '
+                  f'({len(dfs)} tickers)')
+        finally:
+            zp1.TICPATH = ticpath
+
+
+if __name__ == "__main__":
+    _test_read_prc_dat()
@@ -1,4 +1,12 @@
 import os
+import json
+import time
+import datetime
+import contextlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 import toolkit_config as cfg
 
@@ -18,6 +26,38 @@ COLWIDTHS = {
     'High': 20
 }
 
+# Data type of each column (see README.txt)
+DTYPES = {
+    'Volume': 'int64',
+    'Date': 'datetime64[D]',
+    'Adj Close': 'float64',
+    'Close': 'float64',
+    'Open': 'float64',
+    'High': 'float64'
+}
+
+# Number of characters in each line of a ".dat" file (without the newline)
+LINEWIDTH = sum(COLWIDTHS.values())
+
+
+def _mk_slices():
+    """ Returns a list with (<col>, <start>, <end>) for each column in
+    `COLUMNS`, where <start> and <end> are the offsets of the column in a line
+    """
+    result = []
+    start = 0
+    for col in COLUMNS:
+        result.append((col, start, start + COLWIDTHS[col]))
+        start += COLWIDTHS[col]
+    return result
+
+# Offsets are computed once, so lines can be split without recomputing them
+_SLICES = _mk_slices()
+
+# Record layout of a line (including the newline) as raw bytes
+_DAT_DTYPE = np.dtype([(col, f'S{COLWIDTHS[col]}') for col in COLUMNS] + [('_nl', 'S1')])
+
+
 def get_tics(pth):
     """ Reads a file with the tickers (one ticker per line) and returns a list
     with the properly formatted tickers.
@@ -53,7 +93,7 @@ def get_tics(pth):
     return result
 
 
-def read_dat(tic):
+def read_dat(tic, start=None, end=None, kind='lines'):
     """ Returns a list with the lines of the ".dat" file containing the stock
     price information for the ticker `tic`.
 
@@ -63,6 +103,18 @@ def read_dat(tic):
     tic : str
         Ticker symbol, in lower case. 
 
+    start, end : str, optional
+        Dates ('YYYY-MM-DD') of the first and last lines to include. If
+        given, only the lines in this range are read (see `iter_dat`).
+
+    kind : str, optional
+        What to return. One of:
+        - 'lines': a list of strings (see below)
+        - 'records': a list of `DatRecord` objects, one per line
+        - 'table': a `DatTable` with one NumPy array per column, which uses
+          the least memory
+        Defaults to 'lines'.
+
     Returns
     -------
     list
@@ -70,16 +122,49 @@ def read_dat(tic):
         is a line in the file, without newline characters (e.g. '\n')
 
     """
-    
-    result = []
+    if kind == 'lines':
+        return list(iter_dat(tic, start, end))
+    if kind == 'records':
+        return [DatRecord.from_line(line) for line in iter_dat(tic, start, end)]
+    if kind == 'table':
+        return DatTable(read_dat_cols(tic, start, end))
+    msg = f"Unknown kind '{kind}'. Must be one of ['lines', 'records', 'table']"
+    raise Exception(msg)
+
+
+def iter_dat(tic, start=None, end=None):
+    """ Same as `read_dat`, but yields the lines of the ".dat" file one at a
+    time instead of returning a list, so the file is never held in memory.
+
+    Parameters
+    ----------
+    tic : str
+        Ticker symbol, in lower case. 
+
+    start, end : str, optional
+        Dates ('YYYY-MM-DD') of the first and last lines to include. Since
+        lines have a fixed width and are sorted by date, the byte offsets of
+        the first and last lines are found with a binary search (see
+        `_dat_bisect`) and only the lines in between are read.
+
+    Yields
+    ------
+    str
+        A line in the file, without newline characters (e.g. '\n')
+
+    """
     filename = tic + "_prc.dat"
     pathToTic = os.path.join(DATDIR, filename)
-    filehandle = open(pathToTic, "r")
-    for line in filehandle:
-        line = line.rstrip()
-        result.append(line)
-    filehandle.close()
-    return result
+    if start is None and end is None:
+        with open(pathToTic, "r") as filehandle:
+            for line in filehandle:
+                yield line.rstrip()
+        return
+
+    with open(pathToTic, "rb") as fobj:
+        data = _read_dat_range(fobj, start, end)
+    for line in data.decode().splitlines():
+        yield line.rstrip()
 
 
 def line_to_dict(line):
@@ -104,16 +189,157 @@ def line_to_dict(line):
           this column.
     """
 
-    result = {}
-    sum = 0
-    for name in COLUMNS:
-        result[name] = line[sum:(sum+COLWIDTHS[name])]
-        sum += COLWIDTHS[name]
-
+    result = {name: line[start:end] for name, start, end in _SLICES}
     return result
 
 
-def main(csvloc, replace=False):
+def dat_to_cols(data):
+    """ Converts the contents of a ".dat" file into typed columns.
+
+    The bytes are viewed as an array of fixed-width records (one per line),
+    so no Python objects are created for individual lines or fields.
+
+    Parameters
+    ----------
+    data : bytes
+        Contents of a ".dat" file. Each line must have `LINEWIDTH`
+        characters followed by a newline.
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<col> : <array>} where
+        - Each key (<col>) is a column in `COLUMNS`
+        - Each value (<array>) is a NumPy array with the dtype in `DTYPES`
+    """
+    if len(data) % _DAT_DTYPE.itemsize != 0:
+        msg = f"Data length is not a multiple of {_DAT_DTYPE.itemsize} bytes"
+        raise Exception(msg)
+    recs = np.frombuffer(data, dtype=_DAT_DTYPE)
+    if not (recs['_nl'] == b'\n').all():
+        msg = f"All lines must have exactly {LINEWIDTH} characters"
+        raise Exception(msg)
+    return {col: recs[col].astype(DTYPES[col]) for col in COLUMNS}
+
+
+def read_dat_cols(tic, start=None, end=None):
+    """ Returns the contents of the ".dat" file for the ticker `tic` as
+    typed columns (see `dat_to_cols`).
+
+    Parameters
+    ----------
+    tic : str
+        Ticker symbol, in lower case. 
+
+    start, end : str, optional
+        Dates ('YYYY-MM-DD') of the first and last lines to include (see
+        `iter_dat`)
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<col> : <array>}, where each array has the
+        dtype in `DTYPES`.
+    """
+    filename = tic + "_prc.dat"
+    pathToTic = os.path.join(DATDIR, filename)
+    with open(pathToTic, "rb") as filehandle:
+        data = _read_dat_range(filehandle, start, end)
+    if len(data) % _DAT_DTYPE.itemsize != 0:
+        # Last line without a newline
+        data += b'\n'
+    return dat_to_cols(data)
+
+
+# Attribute name of each column in `DatRecord` (e.g. 'Adj Close' -> 'adj_close')
+FIELDS = {col: col.lower().replace(' ', '_') for col in COLUMNS}
+
+_COL_SLICES = {col: slice(start, end) for col, start, end in _SLICES}
+
+
+class DatRecord:
+    """ A line of a ".dat" file with typed values
+
+    Attributes are named after the columns in `COLUMNS` (see `FIELDS`):
+    `volume` (int), `date` (datetime.date), `adj_close`, `close`, `open` and
+    `high` (float). Records use `__slots__`, so they take much less memory
+    than the dictionaries returned by `line_to_dict`.
+    """
+    __slots__ = tuple(FIELDS.values())
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_line(cls, line):
+        """ Creates a record from a line of a ".dat" file
+        """
+        rec = cls.__new__(cls)
+        rec.volume = int(line[_COL_SLICES['Volume']])
+        rec.date = datetime.date.fromisoformat(line[_COL_SLICES['Date']].strip())
+        rec.adj_close = float(line[_COL_SLICES['Adj Close']])
+        rec.close = float(line[_COL_SLICES['Close']])
+        rec.open = float(line[_COL_SLICES['Open']])
+        rec.high = float(line[_COL_SLICES['High']])
+        return rec
+
+    def __eq__(self, other):
+        if not isinstance(other, DatRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'DatRecord({values})'
+
+
+class DatTable:
+    """ The contents of a ".dat" file as one NumPy array per column (see
+    `read_dat_cols`)
+
+    Parameters
+    ----------
+    cols : dict
+        A dictionary with format {<col> : <array>}, as returned by
+        `dat_to_cols`
+
+    Notes
+    -----
+    `table[i]` returns line `i` as a `DatRecord`, `table[i:j]` returns a
+    `DatTable` with lines `i` to `j - 1` (views of the same arrays),
+    `table['Close']` returns a column and iterating over the table yields
+    `DatRecord` objects.
+    """
+    def __init__(self, cols):
+        self.cols = cols
+
+    def __len__(self):
+        return len(self.cols['Date'])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.cols[key]
+        if isinstance(key, slice):
+            return DatTable({col: arr[key] for col, arr in self.cols.items()})
+        if not isinstance(key, (int, np.integer)):
+            msg = f"DatTable indices must be integers, slices or column names, not {type(key).__name__}"
+            raise TypeError(msg)
+        return DatRecord(*[self.cols[col][key].item() for col in COLUMNS])
+
+    def __iter__(self):
+        lists = [self.cols[col].tolist() for col in COLUMNS]
+        for values in zip(*lists):
+            yield DatRecord(*values)
+
+    @property
+    def nbytes(self):
+        """ Total size of the column arrays, in bytes
+        """
+        return sum(arr.nbytes for arr in self.cols.values())
+
+
+def main(csvloc, replace=False, stream=False, workers=None, dedup=False, last_dates=False):
     """ This function will read the relevant ".dat" files for all tickers in
     the `TICPATH` file and create a CSV file with all the data. 
 
@@ -132,6 +358,36 @@ def main(csvloc, replace=False):
     replace : bool, optional
         Whether an existing output file should be replaced. Defaults to False
 
+    stream : bool, optional
+        If True, each row is written to a temporary file ('<csvloc>.tmp')
+        as soon as it is read, and the temporary file is renamed
+        to `csvloc` at the end. Memory use does not depend on the number of
+        tickers and no partial output file is ever visible. The output is
+        identical in both modes. Defaults to False
+
+    workers : int, optional
+        If given, the ".dat" files are converted in a pool of `workers`
+        processes (each file is parsed only once, even if its ticker appears
+        more than once in `TICPATH`). The converted files are written to
+        '<csvloc>.tmp' in ticker order, so the output is identical to the
+        serial modes. Defaults to None (serial conversion)
+
+    dedup : bool, optional
+        If True, tickers listed more than once in `TICPATH` are only included
+        once (at their first position). Defaults to False
+
+    last_dates : bool, optional
+        If True, the last date of each ticker is saved in
+        '<csvloc>.last.json', so that `append` does not have to read
+        `csvloc` to find them. Defaults to False
+
+    Returns
+    -------
+    dict
+        Statistics about the conversion, with format
+        {'rows': <int>, 'seconds': <float>, 'rows_per_sec': <float>}, where
+        'rows' does not include the header.
+
     """
     # Check if output file exists
     if os.path.exists(csvloc) and replace is False:
@@ -142,23 +398,311 @@ def main(csvloc, replace=False):
     tic_col = 'Ticker'
     header = [tic_col] + COLUMNS
 
+    start = time.perf_counter()
+    tics = get_tics(TICPATH)
+    if dedup:
+        # dict keys keep the order in which tickers are first seen
+        tics = list(dict.fromkeys(tics))
+    if workers is not None:
+        nrows = _write_parallel(csvloc, header, tics, workers)
+    elif stream:
+        nrows = _write_stream(csvloc, header, tics)
+    else:
+        nrows = _write_lines(csvloc, header, tics)
+    if last_dates:
+        _save_last_dates(csvloc, {tic: _last_dat_date(tic) for tic in tics})
+    elif os.path.exists(f'{csvloc}.last.json'):
+        # The dates of a previous version of `csvloc`
+        os.remove(f'{csvloc}.last.json')
+    secs = time.perf_counter() - start
+
+    return _mk_stats(nrows, secs)
+
+
+def append(csvloc):
+    """ Adds to the CSV file created by `main` the rows of the ".dat" files
+    that are newer than the last date already in `csvloc` for each ticker.
+
+    Only the new part of each ".dat" file is read: since lines have a fixed
+    width and are sorted by date, the first new line is found with a binary
+    search over the file. The cost of an update therefore depends on the
+    number of new rows, not on the size of the history.
+
+    New rows are added at the end of `csvloc` (after all existing rows).
+    Tickers that are not in `csvloc` yet are added in full. Each ticker is
+    included once, even if it appears more than once in `TICPATH`.
+
+    The last date of each ticker is read from '<csvloc>.last.json' (see the
+    `last_dates` parameter of `main`), which is then updated. If there is no
+    such file, the dates are found by reading `csvloc`.
+
+    Parameters
+    ----------
+    csvloc : str
+        The complete path to the CSV file created by `main`. If this file does
+        not exist, `main` is called to create it (with `last_dates=True`).
+
+    Returns
+    -------
+    dict
+        Statistics about the update (see `main`)
+
+    """
+    if not os.path.exists(csvloc):
+        return main(csvloc, last_dates=True)
+
+    start = time.perf_counter()
+    tracked = os.path.exists(f'{csvloc}.last.json')
+    last_dates = _load_last_dates(csvloc)
+    tics = list(dict.fromkeys(get_tics(TICPATH)))
+
+    dst_lines = []
+    for tic in tics:
+        for src_line in _iter_new_lines(tic, last_dates.get(tic)):
+            dic = line_to_dict(src_line)
+            dst_line = [tic.upper()] + [dic[col] for col in COLUMNS]
+            dst_lines.append(','.join(dst_line) + '\n')
+            last_dates[tic] = dic['Date'].strip()
+
+    # New rows are written with a single call, after all files were read
+    with open(csvloc, 'a') as fobj:
+        fobj.write(''.join(dst_lines))
+    if tracked:
+        _save_last_dates(csvloc, last_dates)
+    secs = time.perf_counter() - start
+
+    return _mk_stats(len(dst_lines), secs)
+
+
+def _mk_stats(nrows, secs):
+    """ Returns the statistics dictionary returned by `main` and `append`
+    """
+    return {
+        'rows': nrows,
+        'seconds': secs,
+        'rows_per_sec': nrows / secs if secs > 0 else float('inf'),
+        }
+
+
+def _dat_date(fobj, i):
+    """ Returns the date (as a 'YYYY-MM-DD' string) in line `i` of the
+    ".dat" file opened (in binary mode) as `fobj`
+    """
+    _, start, end = _SLICES[COLUMNS.index('Date')]
+    fobj.seek(i * _DAT_DTYPE.itemsize + start)
+    return fobj.read(end - start).decode().strip()
+
+
+def _dat_nlines(fobj):
+    """ Returns the number of lines in the ".dat" file opened as `fobj`
+    """
+    size = fobj.seek(0, os.SEEK_END)
+    # The last line may not end with a newline
+    return (size + 1) // _DAT_DTYPE.itemsize
+
+
+def _dat_bisect(fobj, date, side='left'):
+    """ Returns the position of the first line of the ".dat" file opened as
+    `fobj` with a date on or after (side='left') or after (side='right')
+    `date` ('YYYY-MM-DD'). Lines must be sorted by date.
+
+    The offset of line `i` is `i * (LINEWIDTH + 1)`, so no index is stored:
+    each step of the search reads the date of a single line.
+    """
+    lo, hi = 0, _dat_nlines(fobj)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_date = _dat_date(fobj, mid)
+        if mid_date < date or (side == 'right' and mid_date == date):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _read_dat_range(fobj, start=None, end=None):
+    """ Returns the bytes of the lines of the ".dat" file opened as `fobj`
+    with a date from `start` to `end` (inclusive). Either bound can be None.
+    """
+    lo = 0 if start is None else _dat_bisect(fobj, start, side='left')
+    if end is None:
+        fobj.seek(lo * _DAT_DTYPE.itemsize)
+        return fobj.read()
+    hi = _dat_bisect(fobj, end, side='right')
+    fobj.seek(lo * _DAT_DTYPE.itemsize)
+    return fobj.read(max(hi - lo, 0) * _DAT_DTYPE.itemsize)
+
+
+def _last_dat_date(tic):
+    """ Returns the last date in the ".dat" file for `tic`, or None if the
+    file is empty
+    """
+    pathToTic = os.path.join(DATDIR, tic + "_prc.dat")
+    with open(pathToTic, "rb") as fobj:
+        n = _dat_nlines(fobj)
+        if n == 0:
+            return None
+        return _dat_date(fobj, n - 1)
+
+
+def _iter_new_lines(tic, last_date):
+    """ Yields the lines of the ".dat" file for `tic` with a date after
+    `last_date` (all lines if `last_date` is None), without newline
+    characters
+    """
+    pathToTic = os.path.join(DATDIR, tic + "_prc.dat")
+    with open(pathToTic, "rb") as fobj:
+        lo = 0
+        if last_date is not None:
+            # First line with a date after `last_date`
+            lo = _dat_bisect(fobj, last_date, side='right')
+        fobj.seek(lo * _DAT_DTYPE.itemsize)
+        for line in fobj.read().decode().splitlines():
+            yield line.rstrip()
+
+
+def _save_last_dates(csvloc, last_dates):
+    """ Saves the last date of each ticker in the CSV file `csvloc`
+    """
+    pth = f'{csvloc}.last.json'
+    with open(f'{pth}.tmp', 'w') as fobj:
+        json.dump(last_dates, fobj, indent=2)
+    os.replace(f'{pth}.tmp', pth)
+
+
+def _load_last_dates(csvloc):
+    """ Returns a dictionary with the last date of each ticker in the CSV file
+    `csvloc`. The dates are read from '<csvloc>.last.json' or, if this file
+    does not exist, from `csvloc` itself.
+    """
+    pth = f'{csvloc}.last.json'
+    if os.path.exists(pth):
+        with open(pth) as fobj:
+            return json.load(fobj)
+
+    result = {}
+    date_pos = 1 + COLUMNS.index('Date')
+    with open(csvloc) as fobj:
+        next(fobj)
+        for line in fobj:
+            fields = line.split(',')
+            tic, date = fields[0].lower(), fields[date_pos].strip()
+            if date > result.get(tic, ''):
+                result[tic] = date
+    return result
+
+
+def _iter_rows(header, tics):
+    """ Yields the rows of the output CSV file (excluding the header) for the
+    tickers in `tics` as lists of strings, in the order given by `header`
+    """
+    tic_col = header[0]
+    for tic in tics:
+        for src_line in iter_dat(tic):
+            dic = line_to_dict(src_line)
+            dic[tic_col] = tic.upper()
+            yield [dic[col] for col in header]
+
+
+def _write_lines(csvloc, header, tics):
+    """ Writes the output CSV file after creating all its lines in memory.
+    Returns the number of rows written (excluding the header).
+    """
     # This will create a list containing all lines to be included in the output CSV file
     # The advantage of creating the list first is that no empty file will be
     # created in the case of an exception. The disadvantage is that it
     # consumes more memory.
     dst_lines = [header]
-    for tic in get_tics(TICPATH):
-        src_lines = read_dat(tic)
-        for src_line in src_lines:
-            dic = line_to_dict(src_line)
-            dic[tic_col] = tic.upper()
-            dst_line = [dic[col] for col in header]
-            dst_lines.append(dst_line)
+    dst_lines.extend(_iter_rows(header, tics))
 
     with open(csvloc, 'w') as fobj:
         for line in dst_lines:
             line = ','.join(line)
             fobj.write(f'{line}\n')
+    return len(dst_lines) - 1
+
+
+def _write_stream(csvloc, header, tics):
+    """ Writes the output CSV file row by row to a temporary file, which is
+    renamed to `csvloc` once all rows have been written. Returns the number
+    of rows written (excluding the header).
+    """
+    tmp = f'{csvloc}.tmp'
+    nrows = 0
+    try:
+        with open(tmp, 'w') as fobj:
+            fobj.write(','.join(header) + '\n')
+            for line in _iter_rows(header, tics):
+                fobj.write(','.join(line) + '\n')
+                nrows += 1
+        os.replace(tmp, csvloc)
+    except BaseException:
+        # `tmp` does not exist if it could not be opened
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    return nrows
+
+
+def _convert_dat(tic):
+    """ Returns a tuple with the lines of the output CSV file for the ticker
+    `tic` (as a single string) and the number of lines. This is the task
+    run by each worker process in `_write_parallel`.
+    """
+    header = ['Ticker'] + COLUMNS
+    lines = [','.join(row) + '\n' for row in _iter_rows(header, [tic])]
+    return ''.join(lines), len(lines)
+
+
+def _write_parallel(csvloc, header, tics, workers):
+    """ Converts the ".dat" file of each unique ticker in `tics` in a
+    process pool and writes the results to a temporary file in the order of
+    `tics`, which is renamed to `csvloc` at the end. Returns the number of
+    rows written (excluding the header).
+
+    At most 2 * `workers` conversions are submitted ahead of the one being
+    written, and each converted file is dropped after its last position in
+    `tics`, so memory does not grow with the size of the output.
+    """
+    unique = list(dict.fromkeys(tics))
+    uses = Counter(tics)
+    tmp = f'{csvloc}.tmp'
+    nrows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor, open(tmp, 'w') as fobj:
+            fobj.write(','.join(header) + '\n')
+            # Futures for unique[nread:], in order
+            pending = deque()
+            todo = iter(unique)
+
+            def _submit():
+                tic = next(todo, None)
+                if tic is not None:
+                    pending.append(executor.submit(_convert_dat, tic))
+
+            for _ in range(2 * workers):
+                _submit()
+            shards = {}
+            nread = 0
+            for tic in tics:
+                # Tickers are converted in the order they first appear in
+                # `tics`, so only `tic` can be missing here
+                while tic not in shards:
+                    shards[unique[nread]] = pending.popleft().result()
+                    nread += 1
+                    _submit()
+                text, n = shards[tic]
+                fobj.write(text)
+                nrows += n
+                uses[tic] -= 1
+                if uses[tic] == 0:
+                    del shards[tic]
+        os.replace(tmp, csvloc)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    return nrows
 
     
 
@@ -202,15 +746,165 @@ def _test_line_to_dict():
     dic = line_to_dict(lines[0])
     print(dic)
 
+def _test_read_dat_cols():
+    """ Test function for the `read_dat_cols` function. This function will
+    perform the following operations:
+    - Read the ".dat" file for the first ticker with `read_dat_cols`
+    - Read the same file with `read_dat` and `line_to_dict`, converting each
+      value to the type in `DTYPES`
+    - Print whether both give the same values and the time each one takes
+    """
+    tic = get_tics(TICPATH)[0]
+
+    start = time.perf_counter()
+    cols = read_dat_cols(tic)
+    cols_t = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = [line_to_dict(line) for line in read_dat(tic)]
+    exp = {col: np.array([row[col] for row in rows]).astype(DTYPES[col])
+           for col in COLUMNS}
+    dict_t = time.perf_counter() - start
+
+    same = all(np.array_equal(cols[col], exp[col]) for col in COLUMNS)
+    print(f'{tic}: {len(rows)} lines')
+    print(f'Same values: {same}')
+
+    table = DatTable(cols)
+    records = read_dat(tic, kind='records')
+    print(f"DatTable rows and slices: {table[-1] == records[-1] and list(table[1:3]) == records[1:3]}")
+    print(f'read_dat_cols: {cols_t:.4f} s')
+    print(f'line_to_dict:  {dict_t:.4f} s')
+
+
+def _bench_read_dat_memory():
+    """ Reads every ".dat" file as a list of dictionaries (`read_dat` and
+    `line_to_dict`), as `DatRecord` objects and as `DatTable` objects, and
+    prints the memory each representation takes (measured with
+    `tracemalloc`) and the time it takes to create it
+    """
+    import tracemalloc
+
+    tics = list(dict.fromkeys(get_tics(TICPATH)))
+    makers = {
+        'list of dicts': lambda: [[line_to_dict(line) for line in read_dat(tic)] for tic in tics],
+        'DatRecord': lambda: [read_dat(tic, kind='records') for tic in tics],
+        'DatTable': lambda: [read_dat(tic, kind='table') for tic in tics],
+        }
+    nrows = sum(len(read_dat(tic, kind='table')) for tic in tics)
+    print(f'{len(tics)} tickers, {nrows} rows')
+    for label, make in makers.items():
+        start = time.perf_counter()
+        data = make()
+        secs = time.perf_counter() - start
+        del data
+
+        # Measured separately, since tracing slows down allocations
+        tracemalloc.start()
+        data = make()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del data
+        print(f'{label:<14} {size / 2**20:8.1f} MB  {size / nrows:6.0f} bytes/row  {secs:.3f} s')
+
+
+def _test_read_dat_range(start='2020-01-01', end='2020-12-31'):
+    """ Test function for the `start` and `end` parameters of `read_dat` and
+    `read_dat_cols`. For each ticker, checks that only the lines in the range
+    are returned and prints how many lines were read for the first ticker.
+    """
+    tics = list(dict.fromkeys(get_tics(TICPATH)))
+    same = True
+    for tic in tics:
+        exp = [line for line in read_dat(tic)
+               if start <= line_to_dict(line)['Date'].strip() <= end]
+        cols = read_dat_cols(tic, start, end)
+        same &= read_dat(tic, start, end) == exp
+        same &= len(cols['Date']) == len(exp)
+    print(f'Same lines as filtering the whole file: {same}')
+    n = len(read_dat(tics[0], start, end))
+    print(f'{tics[0]} {start} to {end}: {n} of {len(read_dat(tics[0]))} lines read')
+
+
+def _test_append():
+    """ Test function for the `append` function. This function will perform
+    the following operations:
+    - Create a CSV file with `main`
+    - Remove the last 10 rows of every ticker from this file, as if they
+      were not available when `main` was called
+    - Call `append` and print whether the rows were added back
+    """
+    csvloc = 'data.csv'
+    main(csvloc, replace=True, dedup=True)
+    with open(csvloc) as fobj:
+        lines = fobj.readlines()
+
+    # Keep all but the last 10 rows of each ticker
+    by_tic = {}
+    for line in lines[1:]:
+        by_tic.setdefault(line.split(',')[0], []).append(line)
+    with open(csvloc, 'w') as fobj:
+        fobj.write(lines[0])
+        for tic_lines in by_tic.values():
+            fobj.writelines(tic_lines[:-10])
+    # Without '<csvloc>.last.json', the last dates are read from `csvloc`
+    print(f"'{csvloc}.last.json' exists: {os.path.exists(f'{csvloc}.last.json')}")
+
+    stats = append(csvloc)
+    with open(csvloc) as fobj:
+        new_lines = fobj.readlines()
+    print(f"Rows appended: {stats['rows']} (expected {10 * len(by_tic)})")
+    print(f"Same rows as `main`: {sorted(new_lines) == sorted(lines)}")
+
+    # Nothing new to add
+    stats = append(csvloc)
+    print(f"Rows appended on the second call: {stats['rows']}")
+
+
+def _bench_main_workers(csvloc='data.csv', workers=(1, 2, 4, 8)):
+    """ Runs `main` in parallel mode with each number of `workers`, checking
+    that the output is identical to the serial mode, and prints the time
+    each run takes and the peak memory allocated by this process while
+    writing (measured in a separate run, as `tracemalloc` slows it down).
+    Speed-ups above 1 are only possible up to the number of CPUs.
+    """
+    import tracemalloc
+
+    def _peak(**kwargs):
+        tracemalloc.start()
+        main(csvloc, replace=True, dedup=True, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak / 2**20
+
+    serial = main(csvloc, replace=True, dedup=True)
+    with open(csvloc, 'rb') as fobj:
+        exp = fobj.read()
+    print(f"CPUs: {os.cpu_count()}, output: {len(exp) / 2**20:.1f} MB")
+    print(f"serial:     {serial['seconds']:.3f} s, peak {_peak():.1f} MB")
+
+    for nworkers in workers:
+        stats = main(csvloc, replace=True, workers=nworkers, dedup=True)
+        with open(csvloc, 'rb') as fobj:
+            same = fobj.read() == exp
+        speedup = serial['seconds'] / stats['seconds']
+        print(f"workers={nworkers:<3} {stats['seconds']:.3f} s ({speedup:.1f}x), "
+              f"peak {_peak(workers=nworkers):.1f} MB, identical: {same}")
+
+
 if __name__ == "__main__":
     # Test functions
     _test_get_tics()
     _test_read_dat()
     _test_line_to_dict()
+    _test_read_dat_cols()
+    _test_read_dat_range()
+    _bench_read_dat_memory()
 
     # Uncomment to run the main function
     csvloc = 'data.csv'
-    main(csvloc, replace=True)
+    stats = main(csvloc, replace=True, stream=True)
+    print(f"{stats['rows']} rows in {stats['seconds']:.2f} s ({stats['rows_per_sec']:,.0f} rows/s)")
 
     #pass
 
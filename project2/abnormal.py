@@ -0,0 +1,190 @@
+""" abnormal.py
+
+Broadcast abnormal-return engine used by `zid_project2.mk_aret_df`
+
+"""
+import numpy as np
+import pandas as pd
+
+
+# Columns from the FF_CSV file (after `standardise_colnames`)
+FF_COLS = ['mkt-rf', 'smb', 'hml', 'rf', 'mkt']
+
+# Factors used by each benchmark model. The 'mkt' model does not estimate
+# anything: abnormal returns are simply returns in excess of "mkt".
+MODELS = {
+    'mkt': [],
+    'capm': ['mkt-rf'],
+    'ff3': ['mkt-rf', 'smb', 'hml'],
+    }
+
+
+def model_cols(model):
+    """ Returns the list of FF_CSV columns a return data frame must include
+    so that abnormal returns can be computed with `model`.
+
+    Parameters
+    ----------
+    model : str
+        One of the keys in `MODELS`
+
+    Returns
+    -------
+    list
+    """
+    if model not in MODELS:
+        msg = f"Unknown model '{model}'. Must be one of {list(MODELS)}"
+        raise Exception(msg)
+    if model == 'mkt':
+        return ['mkt']
+    return MODELS[model] + ['rf']
+
+
+def _check_cols(ret_df, model):
+    """ Raises an exception if `ret_df` is missing a column needed by `model`
+    """
+    missing = [c for c in model_cols(model) if c not in ret_df.columns]
+    if missing:
+        msg = f"Model '{model}' requires the columns {missing} in `ret_df`"
+        raise Exception(msg)
+
+
+def fit_betas(ret_df, model):
+    """ Estimates the factor loadings of every stock in `ret_df` for the
+    benchmark model `model`.
+
+    Each stock is regressed (OLS, with an intercept) on the model factors,
+    using the days where both the stock excess return and all the factors are
+    available. All stocks are estimated together by solving one batch of
+    normal equations.
+
+    Parameters
+    ----------
+    ret_df : data frame
+        Output of `mk_ret_df`, including the columns in `model_cols(model)`.
+
+    model : str
+        Either 'capm' or 'ff3'
+
+    Returns
+    -------
+    df
+        A data frame where each row is a stock and each column is a factor
+        (plus the intercept, 'alpha'). Stocks without enough observations
+        will have missing values.
+    """
+    _check_cols(ret_df, model)
+    factors = MODELS[model]
+    if not factors:
+        msg = f"Model '{model}' has no factor loadings to estimate"
+        raise Exception(msg)
+    tickers = [c for c in ret_df.columns if c not in FF_COLS]
+
+    y = ret_df[tickers].to_numpy(dtype='float64') - ret_df[['rf']].to_numpy(dtype='float64')
+    x = ret_df[factors].to_numpy(dtype='float64')
+    # Design matrix with an intercept in the first column
+    xa = np.column_stack([np.ones(len(x)), x])
+    k = xa.shape[1]
+
+    # mask[t, j] is 1.0 if stock `j` can be used on day `t`
+    mask = (~np.isnan(y) & ~np.isnan(xa).any(axis=1)[:, None]).astype('float64')
+    xa = np.nan_to_num(xa)
+    y = np.where(mask > 0, y, 0.0)
+
+    # X'X for every stock as a single matrix product:
+    #   gram[j] = sum_t mask[t, j] * xa[t]' xa[t]
+    outer = (xa[:, :, None] * xa[:, None, :]).reshape(len(xa), k * k)
+    gram = (mask.T @ outer).reshape(len(tickers), k, k)
+    xty = (xa.T @ y).T
+
+    nobs = mask.sum(axis=0)
+    ok = nobs > k
+    # Replace singular systems with the identity so the batch solve works,
+    # these estimates are set to NaN below
+    gram[~ok] = np.eye(k)
+    betas = np.linalg.solve(gram, xty[:, :, None])[:, :, 0]
+    betas[~ok] = np.nan
+
+    return pd.DataFrame(betas, index=tickers, columns=['alpha'] + factors)
+
+
+def mk_arets(ret_df, model='mkt'):
+    """ Computes abnormal returns for every stock in `ret_df` in one pass.
+
+    Abnormal returns are defined as:
+        - 'mkt': r - mkt
+        - 'capm': r - rf - b * (mkt-rf)
+        - 'ff3': r - rf - b1 * (mkt-rf) - b2 * smb - b3 * hml
+
+    where the loadings are estimated by `fit_betas` over the full sample.
+    The intercept is not part of the expected return, so it remains in the
+    abnormal returns.
+
+    Parameters
+    ----------
+    ret_df : data frame
+        Output of `mk_ret_df`, including the columns in `model_cols(model)`.
+
+    model : str, optional
+        One of the keys in `MODELS`. Defaults to 'mkt'.
+
+    Returns
+    -------
+    df
+        A data frame with the same index as `ret_df` and one column per stock
+        (all columns of `ret_df` except the FF_CSV columns).
+    """
+    _check_cols(ret_df, model)
+    tickers = [c for c in ret_df.columns if c not in FF_COLS]
+
+    y = ret_df[tickers].to_numpy(dtype='float64')
+    if model == 'mkt':
+        res = y - ret_df[['mkt']].to_numpy(dtype='float64')
+    else:
+        betas = fit_betas(ret_df, model)
+        x = ret_df[MODELS[model]].to_numpy(dtype='float64')
+        b = betas[MODELS[model]].to_numpy().T
+        res = y - ret_df[['rf']].to_numpy(dtype='float64') - x @ b
+
+    return pd.DataFrame(res, index=ret_df.index, columns=tickers)
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_mk_arets():
+    """ Compares `mk_arets` with a per-stock `np.linalg.lstsq` regression
+    and with the original loop for the 'mkt' model
+    """
+    rng = np.random.default_rng(0)
+    n = 500
+    idx = pd.bdate_range('2020-01-01', periods=n)
+    ff = pd.DataFrame(rng.normal(0, 0.01, (n, 3)), index=idx,
+                      columns=['mkt-rf', 'smb', 'hml'])
+    ff['rf'] = 0.0001
+    ff['mkt'] = ff['mkt-rf'] + ff['rf']
+    ret_df = pd.DataFrame({
+        'aaa': 0.0002 + ff['rf'] + 1.2 * ff['mkt-rf'] + 0.3 * ff['smb'] + rng.normal(0, 0.01, n),
+        'bbb': ff['rf'] - 0.5 * ff['hml'] + rng.normal(0, 0.01, n),
+        }, index=idx)
+    ret_df.iloc[:50, 1] = np.nan
+    ret_df = ret_df.join(ff)
+
+    # 'mkt' model
+    exp = ret_df[['aaa', 'bbb']].sub(ret_df['mkt'], axis=0)
+    res = mk_arets(ret_df)
+    print(f"'mkt' model identical to the loop output: {res.equals(exp)}")
+
+    # 'ff3' model
+    betas = fit_betas(ret_df, 'ff3')
+    print(betas)
+    for tic in ['aaa', 'bbb']:
+        df = ret_df[[tic, 'mkt-rf', 'smb', 'hml', 'rf']].dropna()
+        xa = np.column_stack([np.ones(len(df)), df[['mkt-rf', 'smb', 'hml']]])
+        exp, *_ = np.linalg.lstsq(xa, df[tic] - df['rf'], rcond=None)
+        print(f"'{tic}' matches lstsq: {np.allclose(exp, betas.loc[tic])}")
+    print(mk_arets(ret_df, 'ff3').describe())
+
+
+if __name__ == "__main__":
+    _test_mk_arets()
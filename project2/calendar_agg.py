@@ -0,0 +1,127 @@
+""" calendar_agg.py
+
+Calendar aggregation of daily returns (a generalisation of
+`zid_project2.get_avg`)
+
+"""
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import memo
+
+
+# Calendar frequencies and the corresponding Pandas period aliases
+FREQS = {
+    'year': 'Y',
+    'quarter': 'Q',
+    'month': 'M',
+    'week': 'W',
+    }
+
+STATS = ['mean', 'sum', 'compound', 'vol']
+
+
+def agg_by_period(df, freq='year', stats=None):
+    """ Aggregates every column of `df` by calendar period
+
+    Missing values are ignored. For each period and column:
+        - 'mean': average daily value
+        - 'sum': sum of the daily values
+        - 'compound': compounded return, prod(1 + r) - 1
+        - 'vol': standard deviation of the daily values (ddof=1)
+
+    Parameters
+    ----------
+    df : data frame
+        A data frame with a DatetimeIndex (e.g. the output of `mk_ret_df`)
+
+    freq : str, optional
+        One of the keys in `FREQS`. Defaults to 'year'.
+
+    stats : list, optional
+        Statistics to compute, from `STATS`. Defaults to all of them.
+
+    Returns
+    -------
+    df
+        A data frame with a PeriodIndex (one row per period with at least
+        one row in `df`) and a two-level column index: (<stat>, <column>).
+        For example, the average return of each stock in 2020 is
+        `res.loc['2020', 'mean']`.
+    """
+    if freq not in FREQS:
+        msg = f"Unknown frequency '{freq}'. Must be one of {list(FREQS)}"
+        raise Exception(msg)
+    if stats is None:
+        stats = STATS
+    for stat in stats:
+        if stat not in STATS:
+            msg = f"Unknown statistic '{stat}'. Must be one of {STATS}"
+            raise Exception(msg)
+
+    periods = df.index.to_period(FREQS[freq])
+    grouped = df.groupby(periods)
+
+    res = {}
+    for stat in stats:
+        if stat == 'mean':
+            res[stat] = grouped.mean()
+        elif stat == 'sum':
+            res[stat] = grouped.sum(min_count=1)
+        elif stat == 'vol':
+            res[stat] = grouped.std()
+        else:
+            # Sum of log returns, so there is a single groupby reduction
+            with np.errstate(divide='ignore', invalid='ignore'):
+                logs = np.log1p(df)
+            res[stat] = np.expm1(logs.groupby(periods).sum(min_count=1))
+    result = pd.concat(res, axis=1)
+    result.index.name = df.index.name
+    return result
+
+
+def ret_panel(tickers=None, prc_col='adj_close'):
+    """ Returns `mk_ret_df(mk_prc_df(tickers, prc_col))`, building it only
+    the first time it is requested (see `memo.mk_ret_df`)
+
+    Parameters
+    ----------
+    tickers : list, optional
+        List of tickers. Defaults to `cfg.TICKERS`.
+
+    prc_col : str, optional
+        See `zid_project2.mk_prc_df`. Defaults to 'adj_close'.
+
+    Returns
+    -------
+    df
+        A shallow copy of the cached data frame (see `memo`). Changes to it
+        do not affect the cache.
+    """
+    if tickers is None:
+        tickers = cfg.TICKERS
+    return memo.mk_ret_df(tickers, prc_col=prc_col)
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_agg_by_period():
+    """ Compares the yearly means with `get_avg` for every ticker and prints
+    the 2020 statistics
+    """
+    import zid_project2 as zp
+
+    ret_df = ret_panel()
+    res = agg_by_period(ret_df, 'year')
+    same = all(
+        np.isclose(res.loc['2020', ('mean', tic)], zp.get_avg(ret_df, tic, 2020), rtol=1e-12)
+        for tic in ret_df.columns)
+    print(res.loc['2020'].unstack(level=0))
+    print(f'Same yearly means as get_avg: {same}')
+    print(agg_by_period(ret_df[['aapl', 'mkt']], 'quarter', ['compound']).tail())
+
+
+if __name__ == "__main__":
+    _test_agg_by_period()
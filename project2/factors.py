@@ -0,0 +1,238 @@
+""" factors.py
+
+Process-wide store for the daily factors in FF_CSV
+
+The first call to `get_store` reads "ff_daily.csv" (through `prc_cache`)
+into one float64 array per column plus a sorted array of dates, and keeps
+them in memory. Later calls return the same `FactorStore` as long as the
+file does not change (its size and modification time are checked on every
+call), so functions called once per ticker (e.g. `zid_project2.mk_ret_df`)
+no longer read and convert the file every time.
+
+Lookups align factors to any DatetimeIndex with a binary search on the
+dates, without building a data frame for the whole file:
+
+    >> store = factors.get_store()
+    >> df = store.lookup(ret_df.index, ['mkt-rf', 'rf'])
+    >> ret_df = store.join(ret_df, ['mkt'])
+
+The arrays in the store are read-only.
+
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import prc_cache
+import prc_files
+
+
+class FactorStore:
+    """ Daily factors of one FF_CSV file, as typed arrays aligned to `dates`
+
+    Parameters
+    ----------
+    df : data frame
+        Factors with a sorted DatetimeIndex without duplicates (e.g. the
+        output of `prc_cache.read_csv` for FF_CSV)
+
+    Attributes
+    ----------
+    dates : array
+        datetime64 array with the dates of the file, sorted
+
+    cols : dict
+        A dictionary with format {<col> : <float64 array>}
+
+    """
+    def __init__(self, df):
+        index = df.index
+        if not index.is_monotonic_increasing or not index.is_unique:
+            msg = "The factor dates must be sorted and unique"
+            raise Exception(msg)
+        self.dates = index.to_numpy(copy=True)
+        self.dates.flags.writeable = False
+        self.cols = {}
+        for col in df.columns:
+            arr = df[col].to_numpy(dtype='float64', copy=True)
+            arr.flags.writeable = False
+            self.cols[col] = arr
+
+    @property
+    def columns(self):
+        """ List with the factor names
+        """
+        return list(self.cols)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _check(self, cols):
+        """ Raises an exception if a column in `cols` is not in the store
+        """
+        missing = [c for c in cols if c not in self.cols]
+        if missing:
+            msg = f"Unknown factor columns {missing}. Must be in {self.columns}"
+            raise Exception(msg)
+
+    def positions(self, index):
+        """ Returns the position of each date of `index` in `dates` (-1 for
+        dates that are not in the store)
+
+        Parameters
+        ----------
+        index : DatetimeIndex or array of datetime64
+
+        Returns
+        -------
+        array
+            int64 array with the same length as `index`
+        """
+        keys = np.asarray(index).astype(self.dates.dtype)
+        pos = np.searchsorted(self.dates, keys)
+        pos[pos == len(self.dates)] = 0
+        found = self.dates[pos] == keys if len(self.dates) else np.zeros(len(keys), bool)
+        return np.where(found, pos, -1)
+
+    def values(self, index, col):
+        """ Returns a float64 array with the values of the factor `col` on
+        the dates of `index` (NaN for dates that are not in the store)
+        """
+        self._check([col])
+        pos = self.positions(index)
+        out = self.cols[col][pos]
+        out[pos < 0] = np.nan
+        return out
+
+    def lookup(self, index, cols):
+        """ Returns a data frame with the factors `cols` on the dates of
+        `index` (the index of the result). Dates that are not in the store
+        have missing values.
+
+        Parameters
+        ----------
+        index : DatetimeIndex
+
+        cols : list
+            Factor names
+
+        Returns
+        -------
+        df
+        """
+        self._check(cols)
+        pos = self.positions(index)
+        missing = pos < 0
+        data = {}
+        for col in cols:
+            arr = self.cols[col][pos]
+            arr[missing] = np.nan
+            data[col] = arr
+        return pd.DataFrame(data, index=index, columns=cols, copy=False)
+
+    def join(self, df, cols):
+        """ Returns `df` with the factors `cols` added as columns, keeping
+        only the rows of `df` whose dates are in the store (in the order of
+        `df`). Same as `df.join(factor_df[cols], how='inner')`.
+
+        Parameters
+        ----------
+        df : data frame
+            A data frame with a DatetimeIndex
+
+        cols : list
+            Factor names
+
+        Returns
+        -------
+        df
+        """
+        self._check(cols)
+        pos = self.positions(df.index)
+        keep = pos >= 0
+        if not keep.all():
+            df = df[keep]
+            pos = pos[keep]
+        else:
+            df = df.copy()
+        for col in cols:
+            df[col] = self.cols[col][pos]
+        return df
+
+
+_STORES = {}
+_LOCK = threading.Lock()
+
+
+def get_store(pth=None):
+    """ Returns the `FactorStore` for the file `pth`, loading it the first
+    time (or after the file changed)
+
+    Parameters
+    ----------
+    pth : str, optional
+        Location of the factor CSV file. Defaults to "ff_daily.csv" in
+        `cfg.DATADIR`.
+
+    Returns
+    -------
+    FactorStore
+    """
+    if pth is None:
+        pth = os.path.join(cfg.DATADIR, 'ff_daily.csv')
+    stat = prc_files.src_stat(pth)
+    entry = _STORES.get(pth)
+    if entry is not None and entry[0] == stat:
+        return entry[1]
+    with _LOCK:
+        entry = _STORES.get(pth)
+        if entry is None or entry[0] != stat:
+            entry = _STORES[pth] = (stat, FactorStore(prc_cache.read_csv(pth)))
+    return entry[1]
+
+
+def clear():
+    """ Removes every store from memory
+    """
+    with _LOCK:
+        _STORES.clear()
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_factor_store():
+    """ Compares the lookups with the data frame joins they replace and
+    prints the time of both
+    """
+    import time
+
+    pth = os.path.join(cfg.DATADIR, 'ff_daily.csv')
+    store = get_store(pth)
+    print(f'{len(store)} dates, columns {store.columns}, same store: {get_store(pth) is store}')
+
+    ff = prc_cache.read_csv(pth)
+    ret_df = pd.DataFrame({'x': np.arange(6.0)}, index=pd.DatetimeIndex(
+        ['2020-10-16', '1900-01-01', '2020-10-12', '2020-10-17', '2020-10-13', '2099-01-01']))
+    ret_df.index = ret_df.index.astype(ff.index.dtype)
+    cols = ['mkt', 'rf']
+    print(f"join: {store.join(ret_df, cols).equals(ret_df.join(ff[cols], how='inner'))}")
+    print(f"lookup: {store.lookup(ret_df.index, cols).equals(ff[cols].reindex(ret_df.index))}")
+
+    idx = ff.index[::2]
+    n = 200
+    start = time.perf_counter()
+    for _ in range(n):
+        prc_cache.read_csv(pth)[cols].reindex(idx)
+    print(f'read_csv + reindex: {(time.perf_counter() - start) / n * 1e3:.3f} ms')
+    start = time.perf_counter()
+    for _ in range(n):
+        get_store(pth).lookup(idx, cols)
+    print(f'get_store + lookup: {(time.perf_counter() - start) / n * 1e3:.3f} ms')
+
+
+if __name__ == "__main__":
+    _test_factor_store()
@@ -0,0 +1,228 @@
+""" memo.py
+
+Memoization of `read_prc_csv`, `mk_prc_df` and `mk_ret_df`
+
+Results are kept in an LRU cache whose size is measured in bytes. Keys
+include the size and modification time of every source CSV file, so a
+result is never returned after one of its files changed. The cached columns
+are read-only arrays, and every call returns a new shallow copy of the
+cached data frame: with Copy-on-Write, changes to the returned data frame
+(values, columns or rows) copy the data they modify, so they never reach
+the cache or the results of later calls.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import config as cfg
+import prc_files
+
+
+# Default maximum size of the cache
+MAX_BYTES = 256 * 2**20
+
+
+class LRUCache:
+    """ Least-recently-used cache limited to `max_bytes`
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size of the cached values. The least recently used
+        values are evicted when this limit is exceeded.
+
+    Attributes
+    ----------
+    hits : int
+        Number of lookups that found a value
+
+    misses : int
+        Number of lookups that did not find a value
+
+    """
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the value for `key`, or None if it is not in the cache
+        """
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value, nbytes):
+        """ Adds `value` (of size `nbytes`) to the cache, evicting the least
+        recently used values if needed. Values larger than `max_bytes` are
+        not cached.
+        """
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._data[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, size) = self._data.popitem(last=False)
+                self.nbytes -= size
+
+    def clear(self):
+        """ Removes all values and resets the counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ Returns a dictionary with the hit/miss counters and the size of
+        the cache
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._data),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                }
+
+
+CACHE = LRUCache()
+
+
+def _fingerprint(tickers, ff=False):
+    """ Returns a tuple with the size and modification time of the CSV file
+    of each ticker (and of FF_CSV if `ff` is True)
+    """
+    pths = [os.path.join(cfg.DATADIR, f'{tic}_prc.csv') for tic in tickers]
+    if ff:
+        pths.append(cfg.FF_CSV)
+    return tuple(tuple(prc_files.src_stat(pth)) for pth in pths)
+
+
+def _read_only(df):
+    """ Returns a copy of `df` where every column is a read-only array
+    """
+    data = {}
+    for col in df.columns:
+        arr = df[col].to_numpy(copy=True)
+        arr.flags.writeable = False
+        data[col] = arr
+    return pd.DataFrame(data, index=df.index, columns=df.columns, copy=False)
+
+
+def _cached(key, func):
+    """ Returns a shallow copy of the cached value for `key`, calling `func`
+    to create it if needed
+    """
+    res = CACHE.get(key)
+    if res is None:
+        res = _read_only(func())
+        CACHE.put(key, res, int(res.memory_usage(index=True, deep=True).sum()))
+    # The caller must not be able to add, drop or replace the columns of the
+    # cached data frame
+    return res.copy(deep=False)
+
+
+def _date_key(date):
+    """ Returns `date` in a form that can be part of a cache key
+    """
+    return None if date is None else pd.Timestamp(date)
+
+
+def read_prc_csv(tic, start=None, end=None, columns=None):
+    """ Memoized version of `zid_project2.read_prc_csv`. Changes to the
+    data frame do not affect the cache.
+    """
+    import zid_project2 as zp
+
+    tic = tic.lower()
+    cols_key = None if columns is None else tuple(columns)
+    key = ('read_prc_csv', tic, _date_key(start), _date_key(end), cols_key, _fingerprint([tic]))
+    return _cached(key, lambda: zp.read_prc_csv(tic, start=start, end=end, columns=columns))
+
+
+def mk_prc_df(tickers, prc_col='adj_close', start=None, end=None):
+    """ Memoized version of `zid_project2.mk_prc_df`. Changes to the data
+    frame do not affect the cache.
+    """
+    import zid_project2 as zp
+
+    tickers = tuple(tic.lower() for tic in tickers)
+    key = ('mk_prc_df', tickers, prc_col, _date_key(start), _date_key(end), _fingerprint(tickers))
+    return _cached(key, lambda: zp.mk_prc_df(list(tickers), prc_col=prc_col, start=start, end=end))
+
+
+def mk_ret_df(tickers, prc_col='adj_close', ff_cols=None):
+    """ Memoized version of `zid_project2.mk_ret_df(mk_prc_df(tickers,
+    prc_col), ff_cols)`. Changes to the data frame do not affect the cache.
+
+    The prices are obtained with the memoized `mk_prc_df`, so they are also
+    reused by later calls.
+    """
+    import zid_project2 as zp
+
+    tickers = tuple(tic.lower() for tic in tickers)
+    ff_key = None if ff_cols is None else tuple(ff_cols)
+    key = ('mk_ret_df', tickers, prc_col, ff_key, _fingerprint(tickers, ff=True))
+    return _cached(key, lambda: zp.mk_ret_df(mk_prc_df(tickers, prc_col), ff_cols=ff_cols))
+
+
+def stats():
+    """ Returns the hit/miss counters and the size of the cache (see
+    `LRUCache.stats`)
+    """
+    return CACHE.stats()
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_memo():
+    """ Calls the memoized functions twice and prints the cache statistics
+    """
+    import time
+
+    tickers = cfg.TICKERS
+    for i in range(2):
+        start = time.perf_counter()
+        ret_df = mk_ret_df(tickers)
+        print(f'mk_ret_df call {i + 1}: {time.perf_counter() - start:.4f} s')
+    print(stats())
+
+    # Changes to a returned data frame must not show up in the next hit
+    exp = mk_ret_df(tickers).copy()
+    ret_df.iloc[0, 0] = 1.0
+    ret_df[ret_df.columns[1]] = 0.0
+    ret_df['new'] = 0.0
+    ret_df.drop(columns=ret_df.columns[2], inplace=True)
+    ret_df.drop(index=ret_df.index[:10], inplace=True)
+    print(f'Cached data frame unchanged after modifying a hit: {mk_ret_df(tickers).equals(exp)}')
+
+    # With room for only about one data frame, 'aapl' is evicted when 'tsla'
+    # is added, so the third call is also a miss
+    CACHE.max_bytes = int(mk_prc_df(['aapl']).memory_usage(deep=True).sum() * 1.1)
+    CACHE.clear()
+    mk_prc_df(['aapl'])
+    mk_prc_df(['tsla'])
+    mk_prc_df(['aapl'])
+    print(stats())
+    CACHE.max_bytes = MAX_BYTES
+
+
+if __name__ == "__main__":
+    _test_memo()
@@ -0,0 +1,274 @@
+""" parallel.py
+
+Process-pool execution of the per-ticker analytics of `zid_project2`
+
+`analyse` splits a price panel (the output of `mk_prc_df`) into groups of
+tickers and computes, in worker processes:
+    - daily returns (same as `zid_project2.mk_ret_df`)
+    - abnormal returns (same as `zid_project2.mk_aret_df`)
+    - annualised returns (same as `zid_project2.get_ann_rets`, optional)
+
+The price matrix is copied once into a `multiprocessing.shared_memory`
+block, one contiguous row per ticker, so workers read their tickers without
+the panel being pickled. Returns and abnormal returns are written by the
+workers into two more shared blocks; only the small annualised return
+tables travel back through the pool. Every ticker is computed
+independently (see `returns.mk_rets` and `abnormal.fit_betas`), so the
+result does not depend on how the tickers are split (abnormal returns of the
+'capm' and 'ff3' models can differ from `mk_aret_df` by rounding errors, as
+the matrix products are computed in smaller batches).
+
+Example
+-------
+    >> prc_df = zid_project2.mk_prc_df(tickers)
+    >> res = parallel.analyse(prc_df, model='ff3', ranges=ranges)
+    >> res['aret_df']
+
+Notes
+-----
+Worker processes are started for every call, and the factors are loaded in
+each of them (see `factors.get_store`), so small panels are faster with
+`workers=1`, which runs everything in this process.
+
+"""
+import os
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import factors
+import returns
+import abnormal
+import zid_project2 as zp
+
+
+class _Block:
+    """ A float64 array of shape `shape` in shared memory. `name` can be
+    used to open the same block in another process.
+    """
+    def __init__(self, shape, name=None):
+        self.shape = tuple(shape)
+        nbytes = max(int(np.prod(self.shape)) * 8, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.arr = np.ndarray(self.shape, dtype='float64', buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self, unlink=False):
+        # The array must be released before the memory is closed
+        self.arr = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _run_chunk(prc, rets, arets, task):
+    """ Computes the analytics for the tickers in `task` (rows `lo` to `hi`
+    of `prc`), writes returns and abnormal returns to the same rows of
+    `rets` and `arets` and returns the annualised returns (or None)
+    """
+    lo, hi = task['lo'], task['hi']
+    tickers = task['tickers']
+    prc_df = pd.DataFrame(prc[lo:hi].T, index=task['index'], columns=tickers, copy=False)
+
+    store = factors.get_store(task['ff_pth'])
+    ret_df = store.join(returns.mk_rets(prc_df), task['ff_cols'])
+    rets[lo:hi] = ret_df[tickers].to_numpy().T
+    arets[lo:hi] = abnormal.mk_arets(ret_df, model=task['model']).to_numpy().T
+
+    if task['ranges'] is None:
+        return None
+    return zp.get_ann_rets(ret_df[tickers], task['ranges'])
+
+
+def _work(task):
+    """ Runs `_run_chunk` in a worker process, on the shared blocks named in
+    `task`
+    """
+    blocks = [_Block(shape, name) for shape, name in task['blocks']]
+    try:
+        return _run_chunk(*(block.arr for block in blocks), task)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def _split(ntics, nchunks):
+    """ Returns a list with (lo, hi) bounds splitting `ntics` tickers into at
+    most `nchunks` contiguous groups of similar size
+    """
+    bounds = np.linspace(0, ntics, min(nchunks, ntics) + 1).round().astype(int)
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def analyse(prc_df, model='mkt', ranges=None, workers=None, chunks=None):
+    """ Computes returns, abnormal returns and (optionally) annualised
+    returns for every ticker in `prc_df`, in parallel
+
+    Parameters
+    ----------
+    prc_df : data frame
+        Output of `zid_project2.mk_prc_df`
+
+    model : str, optional
+        Benchmark model for the abnormal returns (see
+        `zid_project2.mk_aret_df`). Defaults to 'mkt'.
+
+    ranges : data frame, optional
+        Periods for the annualised returns (see `zid_project2.get_ann_rets`).
+        Rows with a "ticker" that is not in `prc_df` raise an exception.
+        Defaults to None (no annualised returns).
+
+    workers : int, optional
+        Number of worker processes. If 1, everything runs in this process.
+        Defaults to None (`os.cpu_count()`).
+
+    chunks : int, optional
+        Number of groups of tickers. Defaults to 4 per worker, so that
+        workers that finish early can take more work.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys:
+        - 'ret_df': same as `mk_ret_df(prc_df, ff_cols)`, where `ff_cols`
+          are the columns needed by `model` (see `abnormal.model_cols`)
+        - 'aret_df': same as `mk_aret_df(ret_df, model)`
+        - 'ann_rets': same as `get_ann_rets(ret_df[tickers], ranges)`, or
+          None if `ranges` is None
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunks is None:
+        chunks = 4 * workers
+    ff_pth = os.path.join(cfg.DATADIR, "ff_daily.csv")
+    ff_cols = abnormal.model_cols(model)
+    store = factors.get_store(ff_pth)
+
+    tickers = list(prc_df.columns)
+    ntics = len(tickers)
+    keep = store.positions(prc_df.index) >= 0
+    index = prc_df.index[keep]
+
+    if ranges is not None and 'ticker' not in ranges.columns:
+        # One row per (period, ticker), in the order of `get_ann_rets`
+        ranges = pd.DataFrame({
+            'ticker': tickers * len(ranges),
+            'start': np.repeat(ranges['start'].to_numpy(), ntics),
+            'end': np.repeat(ranges['end'].to_numpy(), ntics),
+            })
+    if ranges is not None:
+        unknown = sorted(set(ranges['ticker']) - set(tickers))
+        if unknown:
+            msg = f"Tickers {unknown} are not columns of `prc_df`"
+            raise Exception(msg)
+
+    prc = _Block((ntics, len(prc_df)))
+    rets = _Block((ntics, len(index)))
+    arets = _Block((ntics, len(index)))
+    try:
+        prc.arr[:] = prc_df.to_numpy(dtype='float64').T
+        tasks = []
+        for lo, hi in _split(ntics, chunks):
+            task = {
+                'lo': lo,
+                'hi': hi,
+                'tickers': tickers[lo:hi],
+                'index': prc_df.index,
+                'model': model,
+                'ff_pth': ff_pth,
+                'ff_cols': ff_cols,
+                'ranges': None,
+                'blocks': [(block.shape, block.name) for block in (prc, rets, arets)],
+                }
+            if ranges is not None:
+                task['ranges'] = ranges[ranges['ticker'].isin(task['tickers'])]
+            tasks.append(task)
+
+        if workers == 1:
+            anns = [_run_chunk(prc.arr, rets.arr, arets.arr, task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                anns = list(executor.map(_work, tasks))
+
+        ret_df = pd.DataFrame(rets.arr.copy().T, index=index, columns=prc_df.columns, copy=False)
+        ret_df = store.join(ret_df, ff_cols)
+        aret_df = pd.DataFrame(arets.arr.copy().T, index=index, columns=prc_df.columns,
+                               copy=False)
+    finally:
+        for block in (prc, rets, arets):
+            block.close(unlink=True)
+
+    ann_rets = None
+    if ranges is not None:
+        # Put the rows back in the order of `ranges`
+        ann_rets = pd.concat([df for df in anns if df is not None])
+        ann_rets = ann_rets.set_axis([
+            i for task in tasks for i in task['ranges'].index])
+        ann_rets = ann_rets.loc[ranges.index].reset_index(drop=True)
+    return {'ret_df': ret_df, 'aret_df': aret_df, 'ann_rets': ann_rets}
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_analyse():
+    """ Compares `analyse` (in this process and with two workers) with the
+    functions in `zid_project2`
+    """
+    tickers = [tic.lower() for tic in cfg.TICKERS]
+    prc_df = zp.mk_prc_df(tickers)
+    ranges = pd.DataFrame({'start': ['2010-01-01', '2015-01-01'], 'end': ['2014-12-31', '2020-12-31']})
+    for model in ['mkt', 'ff3']:
+        ret_df = zp.mk_ret_df(prc_df, ff_cols=abnormal.model_cols(model))
+        aret_df = zp.mk_aret_df(ret_df, model=model)
+        ann_rets = zp.get_ann_rets(ret_df[tickers], ranges)
+        for workers in [1, 2]:
+            res = analyse(prc_df, model=model, ranges=ranges, workers=workers, chunks=5)
+            print(f"'{model}', {workers} worker(s): "
+                  f"ret_df {res['ret_df'].equals(ret_df)}, "
+                  f"aret_df {res['aret_df'].equals(aret_df)} "
+                  f"(close: {np.allclose(res['aret_df'], aret_df, equal_nan=True)}), "
+                  f"ann_rets {res['ann_rets'].equals(ann_rets)}")
+
+
+def _bench_analyse(ntics=1000):
+    """ Prints the time `analyse` takes on a random panel with `ntics`
+    tickers for 1 to `os.cpu_count()` workers (compare the speedup with the
+    number of cores)
+    """
+    import time
+
+    rng = np.random.default_rng(0)
+    dates = factors.get_store().dates[-5000:]
+    prc = 50 * np.cumprod(1 + rng.normal(0.0003, 0.02, (len(dates), ntics)), axis=0)
+    prc[rng.random(prc.shape) < 0.001] = np.nan
+    prc_df = pd.DataFrame(prc, index=pd.DatetimeIndex(dates, name='date'),
+                          columns=[f't{j:05d}' for j in range(ntics)])
+    ranges = pd.DataFrame({'start': ['2005-01-01'], 'end': ['2014-12-31']})
+
+    start = time.perf_counter()
+    ret_df = zp.mk_ret_df(prc_df, ff_cols=abnormal.model_cols('ff3'))
+    zp.mk_aret_df(ret_df, model='ff3')
+    zp.get_ann_rets(ret_df[list(prc_df.columns)], ranges)
+    base = time.perf_counter() - start
+    print(f'{ntics} tickers x {len(dates)} dates, zid_project2: {base:.3f} s')
+
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        start = time.perf_counter()
+        analyse(prc_df, model='ff3', ranges=ranges, workers=workers)
+        secs = time.perf_counter() - start
+        print(f'analyse, {workers} worker(s): {secs:.3f} s (speedup {base / secs:.2f})')
+
+
+if __name__ == "__main__":
+    _test_analyse()
+    _bench_analyse()
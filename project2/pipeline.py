@@ -0,0 +1,251 @@
+""" pipeline.py
+
+Lazy pipeline over the `zid_project2` functions
+
+A `Pipeline` records the operations to perform (prices -> returns ->
+abnormal returns -> statistics) and only runs them when `collect` is called.
+Because the whole plan is known at that point:
+    - Only the selected tickers and the price column are loaded
+    - Rows outside the date range are skipped by the loader (see the `start`
+      and `end` parameters of `mk_prc_df`). If returns are computed, a few
+      earlier days are also loaded and the last row before the range is
+      kept, so the first return in the range is the same as in the full
+      history.
+    - Only the FF_CSV columns needed by the abnormal return model are kept
+      ("mkt" is also kept if the pipeline ends with the returns, so the
+      result has the same columns as `mk_ret_df`)
+
+Example
+-------
+    >> p = Pipeline(['aapl', 'tsla']).between('2010-01-01', '2020-12-31')
+    >> p = p.returns().abnormal().ann_ret()
+    >> print(p.explain())
+    >> res = p.collect()
+
+"""
+import copy
+
+import pandas as pd
+
+import config as cfg
+import abnormal
+import calendar_agg
+import zid_project2 as zp
+
+
+# Steps that produce a final result (must be the last step)
+_TERMINAL = ['ann_ret', 'agg']
+
+# Calendar days loaded before the start of the range to find the previous
+# price when computing returns. If there are no prices in these days, the
+# full history before the range is loaded instead.
+_LOOKBACK_DAYS = 10
+
+
+class Pipeline:
+    """ Lazy sequence of operations starting from the prices of `tickers`
+
+    Parameters
+    ----------
+    tickers : list, optional
+        Tickers to load. Defaults to `cfg.TICKERS`.
+
+    prc_col : str, optional
+        Price column used to compute returns. Defaults to 'adj_close'.
+
+    Notes
+    -----
+    Every method returns a new `Pipeline`, so a pipeline can be used as the
+    starting point of several others.
+
+    """
+    def __init__(self, tickers=None, prc_col='adj_close'):
+        if tickers is None:
+            tickers = cfg.TICKERS
+        self._tickers = [tic.lower() for tic in tickers]
+        self._prc_col = prc_col
+        self._start = None
+        self._end = None
+        self._steps = []
+
+    def _add(self, name, **kwargs):
+        """ Returns a copy of this pipeline with an extra step
+        """
+        names = [step for step, _ in self._steps]
+        if names and names[-1] in _TERMINAL:
+            msg = f"Cannot add '{name}' after '{names[-1]}'"
+            raise Exception(msg)
+        if name != 'returns' and 'returns' not in names:
+            msg = f"'{name}' requires a 'returns' step first"
+            raise Exception(msg)
+        if name in names:
+            msg = f"The pipeline already has a '{name}' step"
+            raise Exception(msg)
+        new = copy.copy(self)
+        new._steps = self._steps + [(name, kwargs)]
+        return new
+
+    # ------------------------------------------------------------------
+    #   Filters (pushed down to the loader)
+    # ------------------------------------------------------------------
+    def select(self, tickers):
+        """ Keeps only `tickers` (which must be part of this pipeline)
+        """
+        tickers = [tic.lower() for tic in tickers]
+        missing = [tic for tic in tickers if tic not in self._tickers]
+        if missing:
+            msg = f"Tickers {missing} are not part of this pipeline"
+            raise Exception(msg)
+        new = copy.copy(self)
+        new._tickers = tickers
+        return new
+
+    def between(self, start=None, end=None):
+        """ Keeps only the dates from `start` to `end` (inclusive, strings in
+        ISO format). Either bound can be None.
+        """
+        new = copy.copy(self)
+        if start is not None:
+            new._start = pd.Timestamp(start)
+        if end is not None:
+            new._end = pd.Timestamp(end)
+        return new
+
+    # ------------------------------------------------------------------
+    #   Steps
+    # ------------------------------------------------------------------
+    def returns(self):
+        """ Daily returns (see `zid_project2.mk_ret_df`)
+        """
+        return self._add('returns')
+
+    def abnormal(self, model='mkt'):
+        """ Abnormal returns (see `zid_project2.mk_aret_df`)
+        """
+        abnormal.model_cols(model)
+        return self._add('abnormal', model=model)
+
+    def ew(self):
+        """ Returns of an equally-weighted portfolio of all the tickers, as a
+        data frame with a single column, "ew" (see
+        `zid_project2.get_ew_rets`)
+        """
+        return self._add('ew')
+
+    def ann_ret(self):
+        """ Annualised return of each column over the whole date range (see
+        `zid_project2.get_ann_rets`). Returns a series.
+        """
+        return self._add('ann_ret')
+
+    def agg(self, freq='year', stats=None):
+        """ Calendar aggregation (see `calendar_agg.agg_by_period`)
+        """
+        return self._add('agg', freq=freq, stats=stats)
+
+    # ------------------------------------------------------------------
+    #   Execution
+    # ------------------------------------------------------------------
+    def _ff_cols(self):
+        """ Returns the FF_CSV columns needed by the pipeline
+        """
+        for name, kwargs in self._steps:
+            if name == 'abnormal':
+                return abnormal.model_cols(kwargs['model'])
+        if self._steps[-1][0] == 'returns':
+            return ['mkt']
+        return []
+
+    def explain(self):
+        """ Returns a string describing how the pipeline will be executed
+        """
+        names = [name for name, _ in self._steps]
+        lookback = ''
+        if 'returns' in names and self._start is not None:
+            lookback = f' (from {_LOOKBACK_DAYS} days earlier, keeping one earlier row)'
+        lines = [
+            f"load {self._prc_col} for {self._tickers}",
+            f"  dates {self._start} to {self._end}{lookback}",
+            ]
+        for name, kwargs in self._steps:
+            if name == 'returns':
+                lines.append(f"returns with FF_CSV columns {self._ff_cols()}")
+                lines.append(f"  keep dates {self._start} to {self._end}")
+            else:
+                args = ', '.join(f'{k}={v!r}' for k, v in kwargs.items())
+                lines.append(f"{name}({args})")
+        return '\n'.join(lines)
+
+    def _trim(self, df, lookback=0):
+        """ Keeps the rows of `df` in the date range, plus `lookback` earlier
+        rows
+        """
+        lo, hi = 0, len(df)
+        if self._start is not None:
+            lo = max(df.index.searchsorted(self._start, side='left') - lookback, 0)
+        if self._end is not None:
+            hi = df.index.searchsorted(self._end, side='right')
+        return df.iloc[lo:hi]
+
+    def _load(self, lookback):
+        """ Returns the prices in the date range, plus `lookback` earlier
+        rows (0 or 1)
+        """
+        start = self._start
+        if lookback and start is not None:
+            start = start - pd.Timedelta(days=_LOOKBACK_DAYS)
+        df = zp.mk_prc_df(self._tickers, prc_col=self._prc_col, start=start, end=self._end)
+        if lookback and start is not None and (len(df) == 0 or df.index[0] >= self._start):
+            # No prices shortly before the range
+            df = zp.mk_prc_df(self._tickers, prc_col=self._prc_col, end=self._end)
+        return self._trim(df, lookback=lookback)
+
+    def collect(self):
+        """ Runs the pipeline and returns the result
+        """
+        names = [name for name, _ in self._steps]
+        df = self._load(lookback=1 if 'returns' in names else 0)
+
+        for name, kwargs in self._steps:
+            if name == 'returns':
+                df = zp.mk_ret_df(df, ff_cols=self._ff_cols())
+                df = self._trim(df)
+            elif name == 'abnormal':
+                df = zp.mk_aret_df(df, model=kwargs['model'])
+            elif name == 'ew':
+                df = zp.get_ew_rets(df, self._tickers).to_frame('ew')
+            elif name == 'ann_ret':
+                cols = [c for c in df.columns if c not in abnormal.FF_COLS]
+                start = self._start if self._start is not None else df.index.min()
+                end = self._end if self._end is not None else df.index.max()
+                ranges = pd.DataFrame({'start': [start], 'end': [end]})
+                res = zp.get_ann_rets(df[cols], ranges)
+                df = res.set_index('ticker')['ann_ret']
+            elif name == 'agg':
+                df = calendar_agg.agg_by_period(df, kwargs['freq'], kwargs['stats'])
+        return df
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_pipeline():
+    """ Compares the Q3 and Q4 answers computed eagerly and with a pipeline
+    """
+    start, end = '2010-01-01', '2020-12-31'
+
+    p = Pipeline(['tsla']).between(start, end).returns().abnormal().ann_ret()
+    print(p.explain())
+    res = p.collect()['tsla']
+    exp = zp.get_ann_ret(zp.mk_aret_df(zp.mk_ret_df(zp.mk_prc_df(['tsla'])))['tsla'], start, end)
+    print(f'Q4 pipeline: {res:.10f}  eager: {exp:.10f}')
+
+    p = Pipeline(['tsla']).between(start, end).returns().ann_ret()
+    print(p.explain())
+    res = p.collect()['tsla']
+    exp = zp.get_ann_ret(zp.mk_ret_df(zp.mk_prc_df(['tsla']))['tsla'], start, end)
+    print(f'Q3 pipeline: {res:.10f}  eager: {exp:.10f}')
+
+
+if __name__ == "__main__":
+    _test_pipeline()
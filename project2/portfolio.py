@@ -0,0 +1,176 @@
+""" portfolio.py
+
+Portfolio return engine
+
+Returns for many portfolios are computed together: on each day, the return
+of portfolio `p` is
+
+    sum_j(w[p, j] * b[t, j] * r[t, j]) / sum_j(w[p, j] * b[t, j])
+
+where the sums only include stocks with a return on day `t`, `w` are the
+portfolio weights and `b` adjusts the weights for market values and for the
+drift between rebalancing dates. Both sums are matrix products over all
+portfolios at once.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def mk_weights(portfolios, columns):
+    """ Creates a weight matrix from a dictionary of portfolios
+
+    Parameters
+    ----------
+    portfolios : dict
+        A dictionary with format {<name> : <stocks>}, where <stocks> is either
+        a list of tickers (equal weights) or a dictionary with format
+        {<ticker> : <weight>}
+
+    columns : list
+        All the tickers (e.g. the columns of a data frame with returns)
+
+    Returns
+    -------
+    df
+        A data frame where each row is a portfolio and each column is a
+        ticker in `columns`. Tickers not included in a portfolio have a zero
+        weight.
+    """
+    result = pd.DataFrame(0.0, index=list(portfolios), columns=list(columns))
+    for name, stocks in portfolios.items():
+        if not isinstance(stocks, dict):
+            stocks = {tic: 1.0 for tic in stocks}
+        missing = [tic for tic in stocks if tic not in result.columns]
+        if missing:
+            msg = f"Portfolio '{name}' includes unknown tickers {missing}"
+            raise Exception(msg)
+        for tic, weight in stocks.items():
+            result.loc[name, tic] = weight
+    return result
+
+
+def _period_starts(index, rebalance):
+    """ Returns, for each row of `index`, the position of the first row of its
+    rebalancing period
+    """
+    pos = np.arange(len(index))
+    if rebalance is None:
+        return pos
+    periods = index.to_period(rebalance).asi8
+    change = np.ones(len(index), dtype=bool)
+    change[1:] = periods[1:] != periods[:-1]
+    return np.maximum.accumulate(np.where(change, pos, 0))
+
+
+def mk_port_rets(ret_df, weights, rebalance=None, cap_df=None):
+    """ Computes the daily returns of many portfolios at once
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A data frame with daily stock returns (e.g. the output of
+        `mk_ret_df`), sorted by date. Missing returns are excluded: on each
+        day, the weights of the stocks with a return are scaled so they add
+        up to one. Weights must therefore be non-negative.
+
+    weights : data frame
+        Portfolio weights, with one row per portfolio and one column per
+        ticker (see `mk_weights`). Columns of `ret_df` that are not in
+        `weights` are ignored.
+
+    rebalance : str, optional
+        How often the portfolios are rebalanced, as a Pandas period alias
+        (e.g. 'M', 'Q'). Weights are reset on the first day of each period
+        and drift with the stock returns until the next period. Defaults to
+        None, which means the weights are reset every day.
+
+    cap_df : data frame, optional
+        Market values (e.g. the output of `mk_cap_df`) with the same index as
+        `ret_df`. If given, each stock's weight is multiplied by its market
+        value on the day before the weights are reset (value weighting).
+
+    Returns
+    -------
+    df
+        A data frame with the same index as `ret_df` and one column per
+        portfolio. Days with no returns for any stock in a portfolio are
+        missing.
+    """
+    tickers = list(weights.columns)
+    ret = ret_df[tickers].to_numpy(dtype='float64')
+    valid = ~np.isnan(ret)
+    ret = np.where(valid, ret, 0.0)
+    w = weights.to_numpy(dtype='float64')
+
+    starts = _period_starts(ret_df.index, rebalance)
+    base = np.ones(ret.shape)
+    if cap_df is not None:
+        cap = cap_df.reindex(index=ret_df.index, columns=tickers).to_numpy(dtype='float64')
+        # Market value on the day before the weights are reset
+        cap_lag = np.full(cap.shape, np.nan)
+        cap_lag[1:] = cap[:-1]
+        base = np.nan_to_num(cap_lag[starts])
+    if rebalance is not None:
+        # Growth of each stock since the start of its period:
+        # exp(sum of log returns from `start` to `t - 1`)
+        logs = np.zeros((len(ret) + 1, ret.shape[1]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.cumsum(np.log1p(ret), axis=0, out=logs[1:])
+        base = base * np.exp(logs[:-1] - logs[starts])
+
+    num = (base * ret) @ w.T
+    den = (base * valid) @ w.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = np.where(den != 0, num / den, np.nan)
+    return pd.DataFrame(res, index=ret_df.index, columns=weights.index)
+
+
+def mk_cap_df(tickers, workers=None):
+    """ Returns a data frame with the market value proxy (volume x close) of
+    each stock in `tickers`, formatted as the output of `mk_prc_df`
+
+    Parameters
+    ----------
+    tickers : list
+        List of tickers
+
+    workers : int, optional
+        See `zid_project2.mk_prc_dfs`
+    """
+    import zid_project2 as zp
+
+    dfs = zp.mk_prc_dfs(tickers, ['volume', 'close'], workers=workers)
+    return dfs['volume'] * dfs['close']
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_mk_port_rets():
+    """ Test function for `mk_port_rets`
+    """
+    idx = pd.to_datetime(['2020-01-02', '2020-01-03', '2020-01-06', '2020-01-07'])
+    ret_df = pd.DataFrame({
+        'tic1': [0.10, 0.02, None, 0.00],
+        'tic2': [0.00, 0.04, 0.01, 0.00],
+        'tic3': [0.99, 0.99, 0.99, 0.99],
+        }, index=idx)
+    weights = mk_weights({
+        'ew': ['tic1', 'tic2'],
+        'custom': {'tic1': 0.25, 'tic2': 0.75},
+        }, ret_df.columns)
+    print(weights)
+
+    # Daily rebalancing
+    # ew: [0.05, 0.03, 0.01, 0.00]
+    print(mk_port_rets(ret_df, weights))
+
+    # Monthly rebalancing: after the first day, tic1 is worth 1.1 and tic2 is
+    # worth 1.0, so the ew return on 2020-01-03 is
+    # (1.1 * 0.02 + 1.0 * 0.04) / 2.1 = 0.029524
+    print(mk_port_rets(ret_df, weights, rebalance='M'))
+
+
+if __name__ == "__main__":
+    _test_mk_port_rets()
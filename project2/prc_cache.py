@@ -0,0 +1,664 @@
+""" prc_cache.py
+
+Binary cache for the CSV files in `cfg.DATADIR`
+
+Each CSV file is parsed once and saved in `prc_files.CACHEDIR` as a ".prc"
+file with:
+    - 8 bytes with the length of the JSON header (little-endian)
+    - A JSON header with the column names and dtypes, and the modification
+      time and size of the source file
+    - A 2D array in ".npy" format, where the first row is the date index and
+      each other row is a column. All values are 8 bytes wide, so the rows
+      are stored as int64 and viewed back as their original dtype.
+
+Entries are memory-mapped when read, and `read_csv` can select a date range
+and a subset of the columns: only the bytes for those dates and columns are
+read from disk (dates are located with a binary search if the file is
+sorted by date).
+
+Entries are named after the source file plus a short hash of its absolute
+path (e.g. "aapl_prc-1a2b3c4d.prc"), so files with the same name in
+different folders have separate entries.
+
+The cache entry is updated automatically when the modification time or size
+of the source file changes. If the file only grew and its previous last line
+is unchanged (i.e. new rows were appended), only the new rows are parsed and
+saved as a segment at the end of a log file ("<name>-<hash>.seg"), so the
+entry itself is not rewritten. Each segment records the entry it belongs to
+and the size and modification time of the file it extends, so segments
+from other versions of the file are ignored. Once the appended rows
+outnumber the rows of the entry (or after `_MAX_SEGMENTS` segments), they
+are merged into a new entry. Otherwise, the whole file is parsed again.
+
+"""
+import io
+import csv
+import os
+import json
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import prc_files
+import prc_index
+
+# Set to False to always parse the CSV files
+ENABLED = True
+
+# Set to False to parse the whole file again every time it changes, instead
+# of parsing only the appended rows
+APPEND_ONLY = True
+
+# Maximum number of appended segments before they are merged into a new
+# entry
+_MAX_SEGMENTS = 64
+
+# Number of bytes read from the end of a file to find its last line
+_TAIL_BYTES = 4096
+
+# Columns of the price CSV files (standardised names) that are always parsed
+# as float64. Other columns are left to `pd.read_csv`.
+FLOAT_COLS = ['open', 'high', 'low', 'close', 'adj_close']
+
+
+def cache_path(pth):
+    """ Returns the location of the cache entry for the CSV file `pth`
+
+    Parameters
+    ----------
+    pth : str
+        Full path to the CSV file
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(prc_files.CACHEDIR, f'{prc_files.entry_name(pth)}.prc')
+
+
+def _seg_path(pth):
+    """ Returns the location of the log with the segments appended to the
+    cache entry for `pth`
+    """
+    return os.path.join(prc_files.CACHEDIR, f'{prc_files.entry_name(pth)}.seg')
+
+
+def _standardise(raw):
+    """ Formats a data frame read from a CSV file as described in
+    `parse_csv`
+    """
+    df = cfg.standardise_colnames(raw)
+    df = df.set_index(pd.DatetimeIndex(df['date']))
+    df = df.drop(['date'], axis=1)
+    return df
+
+
+def _date_sel(dates, is_sorted, start=None, end=None):
+    """ Returns a slice (if `is_sorted`) or a boolean mask selecting the
+    elements of the datetime64 array `dates` from `start` to `end`
+    (inclusive). Either bound can be None.
+    """
+    if start is None and end is None:
+        return slice(None)
+    lo = None if start is None else pd.Timestamp(start).to_datetime64().astype(dates.dtype)
+    hi = None if end is None else pd.Timestamp(end).to_datetime64().astype(dates.dtype)
+    if is_sorted:
+        i = 0 if lo is None else np.searchsorted(dates, lo, side='left')
+        j = len(dates) if hi is None else np.searchsorted(dates, hi, side='right')
+        return slice(i, j)
+    mask = np.ones(len(dates), dtype=bool)
+    if lo is not None:
+        mask &= dates >= lo
+    if hi is not None:
+        mask &= dates <= hi
+    return mask
+
+
+def _check_columns(pth, columns, available):
+    """ Raises an exception if some of the `columns` are not `available`
+    """
+    missing = [col for col in columns if col not in available]
+    if missing:
+        msg = f"Columns {missing} are not in the file '{pth}'. Available columns: {available}"
+        raise Exception(msg)
+
+
+def between(df, start=None, end=None):
+    """ Returns the rows of `df` (with a DatetimeIndex) from `start` to `end`
+    (inclusive). Either bound can be None.
+    """
+    if start is None and end is None:
+        return df
+    sel = _date_sel(df.index.to_numpy(), df.index.is_monotonic_increasing, start, end)
+    return df.iloc[sel]
+
+
+def _select_lines(body, start=None, end=None):
+    """ Returns the lines of `body` (the contents of a CSV file without the
+    header) whose first field is a date from `start` to `end`, comparing the
+    first 10 bytes of each line as ISO dates (YYYY-MM-DD). The lines are
+    located with NumPy, so the other lines are never parsed.
+
+    Returns None if some line does not start with an ISO date.
+    """
+    if not body.endswith(b'\n'):
+        body += b'\n'
+    buf = np.frombuffer(body, dtype='u1')
+    ends = np.flatnonzero(buf == ord('\n'))
+    begins = np.concatenate([[0], ends[:-1] + 1])
+    if len(ends) == 0 or np.any(ends - begins < 10):
+        return None
+    prefix = buf[begins[:, None] + np.arange(10)]
+    if np.any(prefix[:, [4, 7]] != ord('-')):
+        return None
+    keys = prefix.copy().view('S10').ravel()
+
+    mask = np.ones(len(keys), dtype=bool)
+    if start is not None:
+        mask &= keys >= pd.Timestamp(start).strftime('%Y-%m-%d').encode()
+    if end is not None:
+        mask &= keys <= pd.Timestamp(end).strftime('%Y-%m-%d').encode()
+    return buf[np.repeat(mask, ends - begins + 1)].tobytes()
+
+
+def parse_csv(pth, start=None, end=None, columns=None):
+    """ Parses the CSV file `pth` into a data frame where
+        - Column names are formatted by `cfg.standardise_colnames`
+        - The index is a DatetimeIndex created from the 'date' column
+
+    Parameters
+    ----------
+    pth : str
+        Full path to the CSV file
+
+    start, end : str or Timestamp, optional
+        Only rows from `start` to `end` (inclusive) are returned
+
+    columns : list, optional
+        Columns to return (standardised names). Other columns are not
+        parsed. Defaults to all columns.
+
+    Notes
+    -----
+    If `start` or `end` are given, only the months in the range are read
+    from files sorted by date (see `prc_index`). If every line starts with
+    an ISO date, the lines outside the date range are then dropped before
+    the text is parsed (see `_select_lines`).
+
+    Returns
+    -------
+    df
+    """
+    body = None
+    if start is not None or end is not None:
+        # Only the months in the range are read (see `prc_index`)
+        header, body = prc_index.read_range(pth, start, end)
+    else:
+        with open(pth, 'rb') as fobj:
+            header = fobj.readline()
+    names = next(csv.reader([header.decode()]))
+    std = list(cfg.standardise_colnames(pd.DataFrame(columns=names)).columns)
+    raw_names = dict(zip(std, names))
+
+    usecols = None
+    if columns is not None:
+        _check_columns(pth, columns, std[1:])
+        usecols = [names[0]] + [raw_names[col] for col in columns]
+    dtype = {raw_names[col]: 'float64' for col in FLOAT_COLS
+             if col in raw_names and (columns is None or col in columns)}
+
+    src = pth
+    if body is not None:
+        lines = _select_lines(body, start, end)
+        if lines is not None:
+            src = io.BytesIO(header + lines)
+    raw = pd.read_csv(src, usecols=usecols, dtype=dtype)
+    df = _standardise(raw)
+    if columns is not None:
+        # `usecols` keeps the order of the file
+        df = df[columns]
+    return between(df, start, end)
+
+
+def _last_line(pth, size):
+    """ Returns the last line (as bytes, including the newline) of the first
+    `size` bytes of the file `pth`, or None if it cannot be determined
+    """
+    with open(pth, 'rb') as fobj:
+        start = max(0, size - _TAIL_BYTES)
+        fobj.seek(start)
+        tail = fobj.read(size - start)
+    if not tail.endswith(b'\n'):
+        return None
+    pos = tail.rfind(b'\n', 0, len(tail) - 1)
+    if pos < 0 and start > 0:
+        return None
+    return tail[pos + 1:]
+
+
+def _read_entry(pth):
+    """ Returns a tuple (meta, parts) with the cache entry for `pth`, or None
+    if there is no cache entry. `parts` is a list of 2D blocks (dates in the
+    first row, one column per row after that): the entry, memory-mapped so
+    only the parts that are used are read from disk, followed by the
+    segments appended to it (see `_read_segments`).
+    """
+    cpth = cache_path(pth)
+    if not os.path.exists(cpth):
+        return None
+    with open(cpth, 'rb') as fobj:
+        size = int.from_bytes(fobj.read(8), 'little')
+        meta = json.loads(fobj.read(size))
+        version = np.lib.format.read_magic(fobj)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(fobj)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(fobj)
+        offset = fobj.tell()
+    if 0 in shape:
+        block = np.empty(shape, dtype=dtype)
+    else:
+        block = np.memmap(cpth, dtype=dtype, mode='r', offset=offset, shape=shape,
+                          order='F' if fortran else 'C')
+    parts = [block]
+    _read_segments(pth, meta, parts)
+    return meta, parts
+
+
+def _read_segments(pth, meta, parts):
+    """ Adds to `parts` the segments in the log of `pth` that extend the
+    entry described by `meta`, in order, and updates the 'stat', 'last' and
+    'sorted' values of `meta` to those of the last one. Segments from other
+    entries or other versions of the file, and an incomplete last segment,
+    are skipped.
+    """
+    meta['segments'] = 0
+    spth = _seg_path(pth)
+    if meta.get('id') is None or not os.path.exists(spth):
+        return
+    with open(spth, 'rb') as fobj:
+        data = fobj.read()
+
+    nrows = len(meta['columns']) + 1
+    pos = 0
+    while pos + 8 <= len(data):
+        end = pos + 8 + int.from_bytes(data[pos:pos + 8], 'little')
+        if end > len(data):
+            break
+        rec = json.loads(data[pos + 8:end])
+        count = nrows * rec['rows']
+        if end + 8 * count > len(data):
+            break
+        if rec['base'] == meta['id'] and rec['from'] == meta['stat']:
+            block = np.frombuffer(data, dtype='int64', count=count, offset=end)
+            parts.append(block.reshape(nrows, rec['rows']))
+            meta.update(stat=rec['stat'], last=rec['last'], sorted=rec['sorted'])
+            meta['segments'] += 1
+        pos = end + 8 * count
+
+
+def _cat(arrs):
+    """ Returns the concatenation of the arrays in `arrs` (without a copy if
+    there is only one)
+    """
+    return arrs[0] if len(arrs) == 1 else np.concatenate(arrs)
+
+
+def _entry_to_df(meta, parts, start=None, end=None, columns=None):
+    """ Returns the data frame stored in a cache entry (only the rows from
+    `start` to `end` and the given `columns`, if any)
+    """
+    dates = [part[0].view(meta['index']) for part in parts]
+    is_sorted = meta.get('sorted')
+    if is_sorted is None:
+        # Entries created before the 'sorted' flag was added
+        alldates = _cat(dates)
+        is_sorted = bool(np.all(alldates[1:] >= alldates[:-1]))
+    # Each part of a sorted entry is sorted too
+    sels = [_date_sel(d, is_sorted, start, end) for d in dates]
+
+    if columns is None:
+        columns = meta['columns']
+    pos = {col: i for i, col in enumerate(meta['columns'])}
+    index = pd.DatetimeIndex(_cat([np.array(d[sel]) for d, sel in zip(dates, sels)]), name='date')
+    data = {}
+    for col in columns:
+        row, dtype = pos[col] + 1, meta['dtypes'][pos[col]]
+        data[col] = _cat([np.array(part[row, sel]) for part, sel in zip(parts, sels)]).view(dtype)
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def _extend(pth, stat, meta):
+    """ Returns a data frame with the rows appended to the file `pth` since
+    the cache entry described by `meta` was updated. Returns None if the file
+    was not simply appended to.
+    """
+    old_size = meta['stat'][1]
+    last = meta.get('last')
+    if last is None or stat[1] <= old_size:
+        return None
+    last = last.encode()
+    with open(pth, 'rb') as fobj:
+        fobj.seek(old_size - len(last))
+        if fobj.read(len(last)) != last:
+            return None
+        tail = fobj.read(stat[1] - old_size)
+
+    new = _standardise(pd.read_csv(io.BytesIO(tail), header=None, names=meta['names']))
+    if [str(dtype) for dtype in new.dtypes] != meta['dtypes'] or str(new.index.dtype) != meta['index']:
+        # e.g. a missing value in an integer column
+        return None
+    return new
+
+
+def _cacheable(df):
+    """ Returns True if all columns (and the index) of `df` can be stored as
+    8-byte numeric values
+    """
+    dtypes = list(df.dtypes) + [df.index.dtype]
+    return all(dtype.kind in 'iufM' and dtype.itemsize == 8 for dtype in dtypes)
+
+
+def _to_block(df):
+    """ Returns a 2D int64 array with the dates of `df` in the first row and
+    each column in the next rows (the values are viewed as int64)
+    """
+    block = np.empty((len(df.columns) + 1, len(df)), dtype='int64')
+    block[0] = df.index.to_numpy().view('int64')
+    for i, col in enumerate(df.columns):
+        block[i + 1] = df[col].to_numpy().view('int64')
+    return block
+
+
+def _save(pth, stat, df, names):
+    """ Saves `df` as the cache entry for `pth` (removing the segments of the
+    previous entry). The file is written under a temporary name and then
+    renamed, so readers never see a partial file.
+    """
+    os.makedirs(prc_files.CACHEDIR, exist_ok=True)
+    last = _last_line(pth, stat[1])
+    meta = {
+        'id': f'{time.time_ns()}-{os.getpid()}',
+        'stat': stat,
+        'names': names,
+        'last': last.decode() if last is not None else None,
+        'sorted': bool(df.index.is_monotonic_increasing),
+        'index': str(df.index.dtype),
+        'columns': list(df.columns),
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+        }
+    header = json.dumps(meta).encode()
+    block = _to_block(df)
+
+    fd, tmp = tempfile.mkstemp(dir=prc_files.CACHEDIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(len(header).to_bytes(8, 'little'))
+            fobj.write(header)
+            np.lib.format.write_array(fobj, block)
+        os.replace(tmp, cache_path(pth))
+    except BaseException:
+        os.remove(tmp)
+        raise
+    # Segments of the previous entry are ignored anyway (see `_read_segments`)
+    try:
+        os.remove(_seg_path(pth))
+    except FileNotFoundError:
+        pass
+
+
+def _append_segment(pth, stat, meta, parts, new):
+    """ Adds the rows in `new` (see `_extend`) to the cache entry for `pth`
+    by writing them at the end of its segment log, and updates `meta` and
+    `parts` to include them. Each segment is written with a single call, so
+    concurrent readers see either the whole segment or none of it.
+    """
+    last = _last_line(pth, stat[1])
+    dates = new.index.to_numpy().view('int64')
+    prev = parts[-1][0]
+    is_sorted = bool(meta['sorted'] and new.index.is_monotonic_increasing
+                     and (len(prev) == 0 or len(dates) == 0 or dates[0] >= prev[-1]))
+    rec = {
+        'base': meta['id'],
+        'from': meta['stat'],
+        'stat': stat,
+        'last': last.decode() if last is not None else None,
+        'sorted': is_sorted,
+        'rows': len(new),
+        }
+    header = json.dumps(rec).encode()
+    block = _to_block(new)
+    with open(_seg_path(pth), 'ab') as fobj:
+        fobj.write(len(header).to_bytes(8, 'little') + header + block.tobytes())
+    parts.append(block)
+    meta.update(stat=stat, last=rec['last'], sorted=is_sorted)
+    meta['segments'] += 1
+
+
+def read_csv(pth, start=None, end=None, columns=None):
+    """ Returns the same data frame as `parse_csv(pth, start, end, columns)`,
+    using the binary cache when possible.
+
+    If there is no valid cache entry, the CSV file is parsed and a new entry
+    is written. If the file was appended to, only the new rows are parsed and
+    added to the entry as a segment (see the module docstring). Files with
+    columns that are not 8-byte numbers (e.g. text) are never cached.
+
+    Parameters
+    ----------
+    pth : str
+        Full path to the CSV file
+
+    start, end : str or Timestamp, optional
+        Only rows from `start` to `end` (inclusive) are returned
+
+    columns : list, optional
+        Columns to return (standardised names). Defaults to all columns.
+
+    Returns
+    -------
+    df
+    """
+    if not ENABLED:
+        return parse_csv(pth, start, end, columns)
+
+    stat = prc_files.src_stat(pth)
+    entry = _read_entry(pth)
+    df = None
+    if entry is not None:
+        meta, parts = entry
+        if meta['stat'] == stat:
+            if columns is not None:
+                _check_columns(pth, columns, meta['columns'])
+            return _entry_to_df(meta, parts, start, end, columns)
+        new = None
+        if APPEND_ONLY and meta.get('id') is not None:
+            new = _extend(pth, stat, meta)
+        if new is not None:
+            nseg = sum(part.shape[1] for part in parts[1:]) + len(new)
+            if nseg <= parts[0].shape[1] and meta['segments'] < _MAX_SEGMENTS:
+                try:
+                    _append_segment(pth, stat, meta, parts, new)
+                    if columns is not None:
+                        _check_columns(pth, columns, meta['columns'])
+                    return _entry_to_df(meta, parts, start, end, columns)
+                except OSError:
+                    pass
+            # Merge the segments into a new entry
+            df = pd.concat([_entry_to_df(meta, parts), new])
+            names = meta.get('names')
+
+    if df is None:
+        raw = pd.read_csv(pth)
+        names = list(raw.columns)
+        df = _standardise(raw)
+    if _cacheable(df):
+        try:
+            _save(pth, stat, df, names)
+        except OSError:
+            # A read-only data folder should not prevent reading the data
+            pass
+    if columns is not None:
+        _check_columns(pth, columns, list(df.columns))
+        df = df[columns]
+    return between(df, start, end)
+
+
+def read_file(pth, parse, start=None, end=None, columns=None):
+    """ Same as `read_csv`, for files in other formats (e.g. the ".dat" files
+    of project1)
+
+    Parameters
+    ----------
+    pth : str
+        Full path to the file
+
+    parse : function
+        Function that takes `pth` and returns the data frame for the whole
+        file, with a DatetimeIndex. It is only called if there is no valid
+        cache entry (any change to the file means it is parsed again).
+
+    start, end, columns : optional
+        See `read_csv`
+
+    Returns
+    -------
+    df
+    """
+    stat = prc_files.src_stat(pth)
+    if ENABLED:
+        entry = _read_entry(pth)
+        if entry is not None and entry[0]['stat'] == stat:
+            meta, parts = entry
+            if columns is not None:
+                _check_columns(pth, columns, meta['columns'])
+            return _entry_to_df(meta, parts, start, end, columns)
+
+    df = parse(pth)
+    if ENABLED and _cacheable(df):
+        try:
+            _save(pth, stat, df, None)
+        except OSError:
+            pass
+    if columns is not None:
+        _check_columns(pth, columns, list(df.columns))
+        df = df[columns]
+    return between(df, start, end)
+
+
+def clear():
+    """ Deletes all the cache entries (and the `prc_index` indexes) in
+    `prc_files.CACHEDIR`
+    """
+    cachedir = prc_files.CACHEDIR
+    if not os.path.exists(cachedir):
+        return
+    for name in os.listdir(cachedir):
+        if name.endswith(('.prc', '.seg', '.idx')):
+            os.remove(os.path.join(cachedir, name))
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _bench_read_csv(n=5):
+    """ Prints the time it takes to read every CSV file in `cfg.DATADIR` by
+    parsing the text (cold) and from the cache (warm), and checks that both
+    data frames are identical.
+    """
+    pths = sorted(os.path.join(cfg.DATADIR, name)
+                  for name in os.listdir(cfg.DATADIR) if name.endswith('.csv'))
+    # Make sure all entries exist
+    for pth in pths:
+        read_csv(pth)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        cold = [parse_csv(pth) for pth in pths]
+    cold_t = (time.perf_counter() - start) / n
+
+    start = time.perf_counter()
+    for _ in range(n):
+        warm = [read_csv(pth) for pth in pths]
+    warm_t = (time.perf_counter() - start) / n
+
+    same = all(c.equals(w) for c, w in zip(cold, warm))
+    print(f'Files: {len(pths)}')
+    print(f'Cold (parse CSV): {cold_t:.4f} s')
+    print(f'Warm (cache):     {warm_t:.4f} s')
+    print(f'Speed-up:         {cold_t / warm_t:.1f}x')
+    print(f'Identical data frames: {same}')
+
+
+def _test_append(nbatches=3, n=10):
+    """ Copies a CSV file without its last `nbatches` * `n` rows to a
+    temporary folder, reads it (creating a cache entry), then appends `n`
+    rows at a time and reads it again. Prints whether each result is
+    identical to parsing the full file and whether the rows were added as a
+    segment (without rewriting the entry).
+    """
+    src = os.path.join(cfg.DATADIR, 'tsla_prc.csv')
+    with open(src) as fobj:
+        lines = fobj.readlines()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cachedir, prc_files.CACHEDIR = prc_files.CACHEDIR, os.path.join(tmpdir, 'cache')
+        pth = os.path.join(tmpdir, '_test_append_prc.csv')
+        cut = len(lines) - nbatches * n
+        with open(pth, 'w') as fobj:
+            fobj.writelines(lines[:cut])
+        read_csv(pth)
+        entry_stat = prc_files.src_stat(cache_path(pth))
+
+        for k in range(nbatches):
+            with open(pth, 'a') as fobj:
+                fobj.writelines(lines[cut + k * n:cut + (k + 1) * n])
+            df = read_csv(pth)
+            meta, parts = _read_entry(pth)
+            same = df.equals(parse_csv(pth))
+            rewritten = prc_files.src_stat(cache_path(pth)) != entry_stat
+            print(f"Batch {k + 1}: identical to parse_csv: {same}, "
+                  f"segments: {meta['segments']}, entry rewritten: {rewritten}")
+        prc_files.CACHEDIR = cachedir
+
+
+def _test_pushdown(start='2010-01-01', end='2020-12-31', columns=('adj_close', 'volume')):
+    """ Checks that selecting dates and columns when reading (from the cache
+    and from the CSV file) gives the same result as filtering the full data
+    frame, and prints the time it takes to read every CSV file both ways
+    """
+    global ENABLED
+
+    pths = sorted(os.path.join(cfg.DATADIR, name)
+                  for name in os.listdir(cfg.DATADIR) if name.endswith('_prc.csv'))
+    columns = list(columns)
+    for pth in pths:
+        full = parse_csv(pth)
+        exp = full[columns][(full.index >= start) & (full.index <= end)]
+        cached = read_csv(pth, start, end, columns)
+        parsed = parse_csv(pth, start, end, columns)
+        if not (cached.equals(exp) and parsed.equals(exp)):
+            print(f'Different results for {os.path.basename(pth)}')
+
+    for enabled in [True, False]:
+        ENABLED = enabled
+        t0 = time.perf_counter()
+        for pth in pths:
+            read_csv(pth)
+        t1 = time.perf_counter()
+        for pth in pths:
+            read_csv(pth, start, end, columns)
+        t2 = time.perf_counter()
+        label = 'cache' if enabled else 'CSV'
+        print(f'{label:<5}  all rows and columns: {t1 - t0:.4f} s  '
+              f'{start} to {end}, {columns}: {t2 - t1:.4f} s')
+    ENABLED = True
+
+
+if __name__ == "__main__":
+    _bench_read_csv()
+    _test_append()
+    _test_pushdown()
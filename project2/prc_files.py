@@ -0,0 +1,35 @@
+""" prc_files.py
+
+Location and validation key of the files derived from the CSV files in
+`cfg.DATADIR` (`prc_cache` entries and `prc_index` indexes)
+
+Both modules save their files in `CACHEDIR` under the name given by
+`entry_name`, and check them against `src_stat` of the source file.
+
+"""
+import os
+import hashlib
+
+import config as cfg
+
+
+CACHEDIR = os.path.join(os.path.dirname(cfg.DATADIR), 'cache')
+
+
+def src_stat(pth):
+    """ Returns a list with the modification time (ns) and size of the file
+    `pth`. This is the key used to validate cache entries.
+    """
+    st = os.stat(pth)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def entry_name(pth):
+    """ Returns the name (without extension) of the files saved in
+    `CACHEDIR` for the source file `pth`: its name plus a hash of its
+    absolute path, so files with the same name in different folders do not
+    share an entry
+    """
+    name = os.path.splitext(os.path.basename(pth))[0]
+    key = hashlib.sha1(os.path.abspath(pth).encode()).hexdigest()[:8]
+    return f'{name}-{key}'
@@ -0,0 +1,188 @@
+""" prc_index.py
+
+Byte-offset date index for the CSV files in `cfg.DATADIR`
+
+For each CSV file sorted by date, a small JSON sidecar in
+`prc_files.CACHEDIR` ("<name>-<hash>.idx", named like the `prc_cache`
+entries) maps each month ('YYYY-MM') to the byte offset of its first line.
+A date range can then be read by seeking to the first month in the range
+and stopping at the first month after it, instead of scanning the whole
+file.
+
+The index is rebuilt automatically when the modification time or size of the
+source file changes. Files that are not sorted by date (e.g. 'aapl') are
+flagged in the index and always read in full.
+
+"""
+import os
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import prc_files
+
+
+def index_path(pth):
+    """ Returns the location of the index for the CSV file `pth`
+    """
+    return os.path.join(prc_files.CACHEDIR, f'{prc_files.entry_name(pth)}.idx')
+
+
+def build(pth):
+    """ Scans the CSV file `pth` and saves its index
+
+    Parameters
+    ----------
+    pth : str
+        Full path to the CSV file
+
+    Returns
+    -------
+    dict
+        The index, with keys
+        - 'stat': modification time and size of `pth`
+        - 'sorted': True if the lines are sorted by date
+        - 'months': dictionary with format {<YYYY-MM> : <offset>}, where
+          <offset> is the position of the first line of the month (empty if
+          the file is not sorted or a line does not start with an ISO date)
+    """
+    stat = prc_files.src_stat(pth)
+    with open(pth, 'rb') as fobj:
+        header = fobj.readline()
+        body = fobj.read()
+
+    buf = np.frombuffer(body, dtype='u1')
+    begins = np.flatnonzero(buf == ord('\n')) + 1
+    begins = np.concatenate([[0], begins[begins < len(buf)]]) if len(buf) else begins
+    months = {}
+    is_sorted = False
+    if len(begins) and len(buf) - begins[-1] >= 10 and np.all(np.diff(begins) > 10):
+        prefix = buf[begins[:, None] + np.arange(10)]
+        if np.all(prefix[:, [4, 7]] == ord('-')):
+            keys = prefix.copy().view('S10').ravel()
+            is_sorted = bool(np.all(keys[1:] >= keys[:-1]))
+    if is_sorted:
+        month_keys = keys.astype('S7')
+        first = np.flatnonzero(np.concatenate([[True], month_keys[1:] != month_keys[:-1]]))
+        months = {month_keys[i].decode(): int(len(header) + begins[i]) for i in first}
+
+    idx = {'stat': stat, 'sorted': is_sorted, 'months': months}
+    try:
+        os.makedirs(prc_files.CACHEDIR, exist_ok=True)
+        tmp = f'{index_path(pth)}.tmp'
+        with open(tmp, 'w') as fobj:
+            json.dump(idx, fobj)
+        os.replace(tmp, index_path(pth))
+    except OSError:
+        # A read-only data folder should not prevent reading the data
+        pass
+    return idx
+
+
+def load(pth):
+    """ Returns the index for the CSV file `pth` (see `build`), building it
+    if it does not exist or if the file changed
+    """
+    ipth = index_path(pth)
+    if os.path.exists(ipth):
+        with open(ipth) as fobj:
+            idx = json.load(fobj)
+        if idx['stat'] == prc_files.src_stat(pth):
+            return idx
+    return build(pth)
+
+
+def byte_range(idx, start=None, end=None):
+    """ Returns a tuple (lo, hi) with the byte offsets of the lines of the
+    months from `start` to `end`, or None if the index cannot be used. `hi`
+    is None if the range ends at the end of the file.
+    """
+    if not idx['sorted'] or not idx['months']:
+        return None
+    months = list(idx['months'])
+    offsets = list(idx['months'].values())
+    lo, hi = offsets[0], None
+    if start is not None:
+        i = np.searchsorted(months, pd.Timestamp(start).strftime('%Y-%m'), side='left')
+        lo = offsets[i] if i < len(offsets) else idx['stat'][1]
+    if end is not None:
+        i = np.searchsorted(months, pd.Timestamp(end).strftime('%Y-%m'), side='right')
+        hi = offsets[i] if i < len(offsets) else None
+    return lo, hi
+
+
+def read_range(pth, start=None, end=None):
+    """ Returns a tuple (header, body) with the header line of the CSV file
+    `pth` and the lines for the months from `start` to `end` (the whole file
+    if it is not sorted by date)
+
+    Parameters
+    ----------
+    pth : str
+        Full path to the CSV file
+
+    start, end : str or Timestamp, optional
+        First and last dates of the range. Either bound can be None.
+
+    Returns
+    -------
+    tuple
+        Two `bytes` objects. `body` can include lines before `start` or after
+        `end` in the same months.
+    """
+    rng = byte_range(load(pth), start, end)
+    with open(pth, 'rb') as fobj:
+        header = fobj.readline()
+        if rng is None:
+            return header, fobj.read()
+        lo, hi = rng
+        fobj.seek(lo)
+        body = fobj.read() if hi is None else fobj.read(max(hi - lo, 0))
+    return header, body
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_read_range(start='2020-01-01', end='2020-12-31', n=20):
+    """ Checks that `prc_cache.parse_csv` (which uses the index for date
+    ranges) gives the same result as filtering the full data frame, and
+    prints the bytes read and the time it takes for the last year of 'msft'
+    """
+    import prc_cache
+
+    for name in sorted(os.listdir(cfg.DATADIR)):
+        if not name.endswith('.csv'):
+            continue
+        pth = os.path.join(cfg.DATADIR, name)
+        full = prc_cache.parse_csv(pth)
+        exp = full[(full.index >= start) & (full.index <= end)]
+        if not prc_cache.parse_csv(pth, start, end).equals(exp):
+            print(f'Different results for {name}')
+        if not load(pth)['sorted']:
+            print(f'{name} is not sorted by date (read in full)')
+
+    pth = os.path.join(cfg.DATADIR, 'msft_prc.csv')
+    header, body = read_range(pth, start, end)
+    size = os.path.getsize(pth)
+    nlines = body.count(b'\n')
+    print(f'msft {start} to {end}: {len(header) + len(body)} of {size} bytes, '
+          f'{nlines} lines')
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        full = prc_cache.parse_csv(pth)
+        full[(full.index >= start) & (full.index <= end)]
+    t1 = time.perf_counter()
+    for _ in range(n):
+        prc_cache.parse_csv(pth, start, end)
+    t2 = time.perf_counter()
+    print(f'Full parse and filter: {(t1 - t0) / n * 1000:.2f} ms  '
+          f'With the index: {(t2 - t1) / n * 1000:.2f} ms')
+
+
+if __name__ == "__main__":
+    _test_read_range()
@@ -0,0 +1,281 @@
+""" prc_store.py
+
+Memory-mapped price store for the tickers in `cfg.DATADIR`
+
+The store is a folder with:
+    - dates.npy: int64 array with the dates shared by all tickers (the union
+      of the dates in the CSV files)
+    - rows.npy: bool array with shape (tickers, dates). `rows[j, t]` is True
+      if the CSV file for ticker `j` has a row for date `t`
+    - <field>.npy: one contiguous float64 array per field (e.g.
+      'adj_close'), with shape (tickers, dates). Missing values are NaN.
+    - meta.json: tickers, fields, date unit and the size/mtime of the
+      source files
+
+Because each ticker is one contiguous row of a field block, the price series
+returned by `PrcStore` are views into the memory-mapped files whenever the
+requested dates form a contiguous range. Processes that open the same store
+share a single copy of the data through the page cache.
+
+"""
+import os
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import prc_cache
+import prc_files
+
+
+STOREDIR = os.path.join(os.path.dirname(cfg.DATADIR), 'store')
+
+
+def _contiguous(mask):
+    """ Returns a slice selecting the True elements of `mask` if they form a
+    contiguous range, otherwise returns `mask` unchanged
+    """
+    pos = np.flatnonzero(mask)
+    if len(pos) == 0:
+        return slice(0, 0)
+    if pos[-1] - pos[0] + 1 == len(pos):
+        return slice(pos[0], pos[-1] + 1)
+    return mask
+
+
+def _save_npy(pth, arr):
+    """ Saves `arr` to `pth` through a temporary file
+    """
+    tmp = f'{pth}.tmp'
+    with open(tmp, 'wb') as fobj:
+        np.save(fobj, arr)
+    os.replace(tmp, pth)
+
+
+def build(tickers=None, storedir=STOREDIR):
+    """ Builds the store from the CSV files in `cfg.DATADIR`
+
+    Parameters
+    ----------
+    tickers : list, optional
+        Tickers to include. Defaults to `cfg.TICKERS`.
+
+    storedir : str, optional
+        Folder where the store is saved. Defaults to `STOREDIR`.
+
+    Returns
+    -------
+    PrcStore
+        The new store, opened.
+    """
+    if tickers is None:
+        tickers = cfg.TICKERS
+    tickers = sorted(tic.lower() for tic in tickers)
+
+    pths = [os.path.join(cfg.DATADIR, f'{tic}_prc.csv') for tic in tickers]
+    dfs = [prc_cache.read_csv(pth) for pth in pths]
+
+    fields = list(dfs[0].columns)
+    unit = np.datetime_data(dfs[0].index.dtype)[0]
+    idx = dfs[0].index
+    for df in dfs[1:]:
+        idx = idx.union(df.index)
+    dates = idx.to_numpy().astype(f'M8[{unit}]')
+
+    os.makedirs(storedir, exist_ok=True)
+    rows = np.zeros((len(tickers), len(dates)), dtype=bool)
+    pos = [np.searchsorted(dates, df.index.to_numpy().astype(f'M8[{unit}]')) for df in dfs]
+    for j, p in enumerate(pos):
+        rows[j, p] = True
+
+    for field in fields:
+        block = np.full((len(tickers), len(dates)), np.nan)
+        for j, (df, p) in enumerate(zip(dfs, pos)):
+            block[j, p] = df[field].to_numpy(dtype='float64')
+        _save_npy(os.path.join(storedir, f'{field}.npy'), block)
+    _save_npy(os.path.join(storedir, 'dates.npy'), dates.view('int64'))
+    _save_npy(os.path.join(storedir, 'rows.npy'), rows)
+
+    # meta.json is written last, so an incomplete store is never opened
+    meta = {
+        'tickers': tickers,
+        'fields': fields,
+        'unit': unit,
+        'stat': {tic: prc_files.src_stat(pth) for tic, pth in zip(tickers, pths)},
+        }
+    tmp = os.path.join(storedir, 'meta.json.tmp')
+    with open(tmp, 'w') as fobj:
+        json.dump(meta, fobj)
+    os.replace(tmp, os.path.join(storedir, 'meta.json'))
+
+    return PrcStore(storedir)
+
+
+class PrcStore:
+    """ Read-only, memory-mapped view of a store created by `build`
+
+    Parameters
+    ----------
+    storedir : str, optional
+        Folder with the store. Defaults to `STOREDIR`.
+
+    Attributes
+    ----------
+    tickers : list
+        Tickers in the store (lower case, sorted)
+
+    fields : list
+        Field names, formatted by `cfg.standardise_colnames`
+
+    dates : DatetimeIndex
+        Dates shared by all tickers
+
+    """
+    def __init__(self, storedir=STOREDIR):
+        self.storedir = storedir
+        with open(os.path.join(storedir, 'meta.json')) as fobj:
+            self.meta = json.load(fobj)
+        self.tickers = self.meta['tickers']
+        self.fields = self.meta['fields']
+        self._pos = {tic: j for j, tic in enumerate(self.tickers)}
+
+        unit = self.meta['unit']
+        raw = np.load(os.path.join(storedir, 'dates.npy'), mmap_mode='r')
+        self.dates = pd.DatetimeIndex(np.asarray(raw).view(f'M8[{unit}]'), name='date')
+        self._rows = np.load(os.path.join(storedir, 'rows.npy'), mmap_mode='r')
+        self._blocks = {}
+
+    def block(self, field):
+        """ Returns the read-only (tickers, dates) float64 memory map for
+        `field`
+        """
+        if field not in self._blocks:
+            pth = os.path.join(self.storedir, f'{field}.npy')
+            self._blocks[field] = np.load(pth, mmap_mode='r')
+        return self._blocks[field]
+
+    def is_stale(self):
+        """ Returns True if any source CSV file changed after the store was
+        built
+        """
+        for tic in self.tickers:
+            pth = os.path.join(cfg.DATADIR, f'{tic}_prc.csv')
+            if not os.path.exists(pth) or prc_files.src_stat(pth) != self.meta['stat'][tic]:
+                return True
+        return False
+
+    def _tic_pos(self, tickers):
+        """ Returns the position of each ticker in the store
+        """
+        pos = []
+        for tic in tickers:
+            tic = tic.lower()
+            if tic not in self._pos:
+                msg = f"Ticker '{tic}' is not in the store '{self.storedir}'"
+                raise Exception(msg)
+            pos.append(self._pos[tic])
+        return pos
+
+    def _in_range(self, mask, start=None, end=None):
+        """ Returns `mask` (over `self.dates`) with the dates before `start`
+        and after `end` set to False
+        """
+        if start is None and end is None:
+            return mask
+        sel = prc_cache._date_sel(self.dates.to_numpy(), True, start, end)
+        res = np.zeros(len(mask), dtype=bool)
+        res[sel] = mask[sel]
+        return res
+
+    def read_prc(self, tic, start=None, end=None, columns=None):
+        """ Returns a data frame formatted as the output of
+        `zid_project2.read_prc_csv` (see that function for `start`, `end`
+        and `columns`).
+
+        The columns are views into the memory-mapped blocks if the dates of
+        this ticker form a contiguous range of the shared dates. Note that
+        all fields (including 'volume') are float64 and that rows are sorted
+        by date, even if the CSV file is not (e.g. 'aapl').
+        """
+        if columns is None:
+            columns = self.fields
+        missing = [col for col in columns if col not in self.fields]
+        if missing:
+            msg = f"Fields {missing} are not in the store '{self.storedir}'"
+            raise Exception(msg)
+        j = self._tic_pos([tic])[0]
+        sel = _contiguous(self._in_range(self._rows[j], start, end))
+        data = {field: self.block(field)[j, sel] for field in columns}
+        return pd.DataFrame(data, index=self.dates[sel], columns=columns, copy=False)
+
+    def prc_df(self, tickers, prc_col='adj_close', start=None, end=None):
+        """ Returns a data frame formatted as the output of
+        `zid_project2.mk_prc_df` (see that function for `start` and `end`).
+
+        The data frame is a view into the memory-mapped block for `prc_col`
+        if the tickers are adjacent in the store (e.g. all tickers) and
+        their dates form a contiguous range.
+        """
+        tickers = [tic.lower() for tic in tickers]
+        pos = self._tic_pos(tickers)
+        if pos and pos == list(range(pos[0], pos[0] + len(pos))):
+            cols = slice(pos[0], pos[0] + len(pos))
+        else:
+            cols = pos
+        sel = _contiguous(self._in_range(self._rows[cols].any(axis=0), start, end))
+        values = self.block(prc_col)[cols][:, sel]
+        return pd.DataFrame(values.T, index=self.dates[sel], columns=tickers, copy=False)
+
+
+_STORES = {}
+
+
+def open_store(storedir=STOREDIR):
+    """ Returns the `PrcStore` in `storedir`, building it if it does not
+    exist or if a source file changed. Stores are opened once per process.
+    """
+    store = _STORES.get(storedir)
+    if store is None or store.is_stale():
+        if not os.path.exists(os.path.join(storedir, 'meta.json')):
+            store = build(storedir=storedir)
+        else:
+            store = PrcStore(storedir)
+            if store.is_stale():
+                store = build(tickers=store.tickers, storedir=storedir)
+        _STORES[storedir] = store
+    return store
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_prc_store():
+    """ Builds the store, compares it with the CSV data and reports which
+    outputs are views into the memory-mapped blocks
+    """
+    import zid_project2 as zp
+
+    start = time.perf_counter()
+    store = build()
+    print(f'Store built in {time.perf_counter() - start:.3f} s')
+
+    prc_df = store.prc_df(store.tickers)
+    exp = zp.mk_prc_df(store.tickers)
+    print(f'prc_df identical to mk_prc_df: {prc_df.equals(exp)}')
+    shared = np.shares_memory(prc_df.to_numpy(), store.block('adj_close'))
+    print(f'prc_df is a view: {shared}')
+
+    views = 0
+    for tic in store.tickers:
+        df = store.read_prc(tic)
+        exp = zp.read_prc_csv(tic).astype('float64').sort_index()
+        if not df.equals(exp):
+            print(f'read_prc({tic}) differs from read_prc_csv')
+        views += np.shares_memory(df['close'].to_numpy(), store.block('close'))
+    print(f'read_prc views: {views} of {len(store.tickers)} tickers')
+
+
+if __name__ == "__main__":
+    _test_prc_store()
@@ -0,0 +1,125 @@
+""" returns.py
+
+Columnar return engine used by `zid_project2.mk_ret_df`
+
+"""
+import numpy as np
+import pandas as pd
+
+
+RET_KINDS = ['simple', 'log', 'gross']
+
+
+def mk_rets(prc_df, kind='simple', periods=1):
+    """ Computes returns for every column of `prc_df` in a single pass over
+    the underlying NumPy array.
+
+    The rules for missing values are the same as the ones used by the
+    original `mk_ret_df` loop:
+        - The first `periods` rows are always missing
+        - If the current price is missing, the return is missing
+        - If the price `periods` rows earlier is missing, the return is
+          missing
+
+    Parameters
+    ----------
+    prc_df : data frame
+        A Pandas data frame with prices (the output of `mk_prc_df`).
+
+    kind : str, optional
+        The type of return to compute. One of:
+        - 'simple': p[t] / p[t-periods] - 1
+        - 'log': log(p[t] / p[t-periods])
+        - 'gross': p[t] / p[t-periods]
+        Defaults to 'simple'.
+
+    periods : int, optional
+        The horizon (in rows) over which returns are computed. Defaults to 1.
+
+    Returns
+    -------
+    df
+        A new data frame with the same index and columns as `prc_df`. The
+        input data frame is never modified.
+
+    """
+    if kind not in RET_KINDS:
+        msg = f"Unknown return kind '{kind}'. Must be one of {RET_KINDS}"
+        raise Exception(msg)
+    if periods < 1:
+        msg = f"`periods` must be a positive integer, got {periods}"
+        raise Exception(msg)
+
+    prc = prc_df.to_numpy(dtype='float64')
+    res = np.full(prc.shape, np.nan)
+
+    if periods < len(prc):
+        cur = prc[periods:]
+        prev = prc[:-periods]
+        # NaN in either position propagates to the result, which is exactly
+        # the rule the loop implemented with `pd.isna` checks
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if kind == 'simple':
+                # Same expression as the original loop so results are
+                # bit-for-bit identical
+                res[periods:] = (cur - prev) / prev
+            elif kind == 'log':
+                res[periods:] = np.log(cur / prev)
+            else:
+                res[periods:] = cur / prev
+
+    return pd.DataFrame(res, index=prc_df.index, columns=prc_df.columns)
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _mk_rets_loop(prc_df):
+    """ Reference implementation: the per-cell loop previously used by
+    `mk_ret_df` (without the market returns and without modifying the input).
+    """
+    res = prc_df.copy().astype('float64')
+    for i in range(len(prc_df.index)):
+        for j in range(len(prc_df.columns)):
+            if i == 0:
+                res.iloc[i, j] = np.nan
+            elif pd.isna(prc_df.iloc[i, j]):
+                continue
+            elif pd.isna(prc_df.iloc[i - 1, j]):
+                res.iloc[i, j] = np.nan
+            else:
+                res.iloc[i, j] = (prc_df.iloc[i, j] - prc_df.iloc[i - 1, j]) / prc_df.iloc[i - 1, j]
+    return res
+
+
+def _test_mk_rets():
+    """ Equivalence test between `mk_rets` and the original loop. Prints
+    whether both outputs are identical and checks that the input data frame
+    was left untouched.
+    """
+    prc_df = pd.DataFrame({
+        'aapl': [121.09, 121.19, 120.70, 119.01, 124.40, 125.00],
+        'tsla': [446.64, 461.29, None, 439.67, 440.00, None],
+        },
+        index=pd.to_datetime([
+            '2020-10-13',
+            '2020-10-14',
+            '2020-10-15',
+            '2020-10-16',
+            '2020-10-12',
+            '2020-10-19',
+            ],
+        ))
+    before = prc_df.copy()
+
+    exp = _mk_rets_loop(prc_df)
+    res = mk_rets(prc_df)
+
+    print(res)
+    print(f"Identical to the loop output: {res.equals(exp)}")
+    print(f"Input left unchanged: {prc_df.equals(before)}")
+    print(mk_rets(prc_df, kind='log', periods=2))
+
+
+if __name__ == "__main__":
+    _test_mk_rets()
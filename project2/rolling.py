@@ -0,0 +1,278 @@
+""" rolling.py
+
+Rolling-window analytics on the output of `zid_project2.mk_ret_df`
+
+Every statistic is computed from cumulative sums, so the cost does not depend
+on the window length: the sum over the window ending on day `t` is
+`csum[t+1] - csum[t+1-window]`. Missing values count as zero in the sums and
+are excluded from the number of observations in each window.
+
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+from abnormal import FF_COLS
+
+
+WINDOWS = [21, 63, 252]
+
+STATS = ['mean', 'vol', 'beta', 'ann_ret']
+
+
+def _csum(arr):
+    """ Returns the cumulative sum of `arr` along the first axis, with an
+    extra row of zeros at the top
+    """
+    res = np.zeros((arr.shape[0] + 1,) + arr.shape[1:])
+    np.cumsum(arr, axis=0, out=res[1:])
+    return res
+
+
+def _wsum(arr, window):
+    """ Returns the sum of `arr` over each window of `window` rows ending on
+    each row. The first `window - 1` rows use all the rows available.
+    """
+    c = _csum(arr)
+    res = c[1:].copy()
+    res[window:] -= c[1:-window]
+    return res
+
+
+def _prep(ret_df, min_periods, window):
+    """ Returns the tickers, the returns as an array with missing values
+    replaced by zero, the mask of valid values and `min_periods`
+    """
+    tickers = [c for c in ret_df.columns if c not in FF_COLS]
+    arr = ret_df[tickers].to_numpy(dtype='float64')
+    valid = ~np.isnan(arr)
+    if min_periods is None:
+        min_periods = window
+    return tickers, np.where(valid, arr, 0.0), valid, min_periods
+
+
+def _to_df(res, nobs, min_periods, ret_df, tickers):
+    """ Returns `res` as a data frame, setting windows with fewer than
+    `min_periods` observations to NaN
+    """
+    res = np.where(nobs >= min_periods, res, np.nan)
+    return pd.DataFrame(res, index=ret_df.index, columns=tickers)
+
+
+def roll_mean(ret_df, window, min_periods=None):
+    """ Rolling mean of the daily returns of each stock in `ret_df`
+
+    Parameters
+    ----------
+    ret_df : data frame
+        Output of `mk_ret_df`. FF_CSV columns (e.g. "mkt") are ignored.
+
+    window : int
+        Number of rows in each window
+
+    min_periods : int, optional
+        Minimum number of valid observations in a window. Defaults to
+        `window`.
+
+    Returns
+    -------
+    df
+        A data frame with the same index as `ret_df` and one column per stock
+    """
+    tickers, arr, valid, min_periods = _prep(ret_df, min_periods, window)
+    nobs = _wsum(valid.astype('float64'), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = _wsum(arr, window) / nobs
+    return _to_df(res, nobs, min_periods, ret_df, tickers)
+
+
+def roll_vol(ret_df, window, min_periods=None, annualise=False):
+    """ Rolling standard deviation (ddof=1) of the daily returns of each stock
+    in `ret_df`. See `roll_mean` for the parameters.
+
+    If `annualise` is True, the standard deviation is multiplied by
+    sqrt(252).
+    """
+    tickers, arr, valid, min_periods = _prep(ret_df, min_periods, window)
+    # Demeaning first avoids the loss of precision of sum(x**2) - n*mean**2
+    # when the mean is large relative to the standard deviation
+    nvalid = valid.sum(axis=0)
+    mu = np.divide(arr.sum(axis=0), nvalid, out=np.zeros(arr.shape[1]), where=nvalid > 0)
+    arr = np.where(valid, arr - mu, 0.0)
+
+    nobs = _wsum(valid.astype('float64'), window)
+    s1 = _wsum(arr, window)
+    s2 = _wsum(arr * arr, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (s2 - s1 * s1 / nobs) / (nobs - 1)
+    res = np.sqrt(np.maximum(var, 0.0))
+    if annualise:
+        res = res * np.sqrt(252)
+    return _to_df(res, np.where(nobs > 1, nobs, 0), min_periods, ret_df, tickers)
+
+
+def roll_beta(ret_df, window, min_periods=None):
+    """ Rolling beta of each stock in `ret_df` against the "mkt" column,
+    using the days in each window where both returns are available. See
+    `roll_mean` for the parameters.
+    """
+    tickers, arr, valid, min_periods = _prep(ret_df, min_periods, window)
+    mkt = ret_df['mkt'].to_numpy(dtype='float64')
+    valid = valid & ~np.isnan(mkt)[:, None]
+    x = np.where(valid, np.nan_to_num(mkt)[:, None], 0.0)
+    y = np.where(valid, arr, 0.0)
+
+    nobs = _wsum(valid.astype('float64'), window)
+    sx = _wsum(x, window)
+    sy = _wsum(y, window)
+    sxy = _wsum(x * y, window)
+    sxx = _wsum(x * x, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = (sxy - sx * sy / nobs) / (sxx - sx * sx / nobs)
+    return _to_df(res, nobs, min_periods, ret_df, tickers)
+
+
+def roll_ann_ret(ret_df, window, min_periods=None):
+    """ Rolling annualised return of each stock in `ret_df`, computed as in
+    `zid_project2.get_ann_ret`:
+
+        prod(1 + r) ** (252 / N) - 1
+
+    where `N` is the number of valid returns in the window. Windows with a
+    return of -1 (or less) have an annualised return of -1. See `roll_mean`
+    for the parameters.
+    """
+    tickers, arr, valid, min_periods = _prep(ret_df, min_periods, window)
+    nobs = _wsum(valid.astype('float64'), window)
+    # log1p(-1) is -inf, which would turn every later window into NaN in the
+    # cumulative sum, so these returns are counted separately
+    ruin = arr <= -1
+    nruin = _wsum(ruin.astype('float64'), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = _wsum(np.log1p(np.where(ruin, 0.0, arr)), window)
+        res = np.expm1(logs * 252 / nobs)
+    res = np.where(nruin > 0, -1.0, res)
+    return _to_df(res, nobs, min_periods, ret_df, tickers)
+
+
+_FUNCS = {
+    'mean': roll_mean,
+    'vol': roll_vol,
+    'beta': roll_beta,
+    'ann_ret': roll_ann_ret,
+    }
+
+
+def mk_roll_df(ret_df, windows=None, stats=None):
+    """ Computes several rolling statistics over several windows at once
+
+    Parameters
+    ----------
+    ret_df : data frame
+        Output of `mk_ret_df`
+
+    windows : list, optional
+        Window lengths. Defaults to `WINDOWS`.
+
+    stats : list, optional
+        Statistics to compute, from `STATS`. Defaults to all of them.
+
+    Returns
+    -------
+    df
+        A data frame with the same index as `ret_df` and a three-level column
+        index: (<stat>, <window>, <ticker>)
+    """
+    if windows is None:
+        windows = WINDOWS
+    if stats is None:
+        stats = STATS
+    for stat in stats:
+        if stat not in _FUNCS:
+            msg = f"Unknown statistic '{stat}'. Must be one of {STATS}"
+            raise Exception(msg)
+
+    dfs = {(stat, window): _FUNCS[stat](ret_df, window)
+           for stat in stats for window in windows}
+    return pd.concat(dfs, axis=1)
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _naive_roll(ret_df, window, stat):
+    """ Computes a rolling statistic by recomputing every window from scratch
+    """
+    tickers = [c for c in ret_df.columns if c not in FF_COLS]
+    arr = ret_df[tickers].to_numpy(dtype='float64')
+    mkt = ret_df['mkt'].to_numpy(dtype='float64')
+    res = np.full(arr.shape, np.nan)
+    for t in range(window - 1, len(arr)):
+        win = arr[t - window + 1:t + 1]
+        for j in range(arr.shape[1]):
+            y = win[:, j]
+            if np.isnan(y).any():
+                continue
+            if stat == 'mean':
+                res[t, j] = y.mean()
+            elif stat == 'vol':
+                res[t, j] = y.std(ddof=1)
+            elif stat == 'beta':
+                x = mkt[t - window + 1:t + 1]
+                res[t, j] = np.cov(y, x)[0, 1] / x.var(ddof=1)
+            else:
+                res[t, j] = np.prod(1 + y) ** (252 / window) - 1
+    return pd.DataFrame(res, index=ret_df.index, columns=tickers)
+
+
+def _test_roll_ann_ret(window=2):
+    """ Compares `roll_ann_ret` with the naive approach on returns that
+    include a return of -1, which must only affect the windows that contain
+    it
+    """
+    index = pd.date_range('2020-01-01', periods=8, freq='B')
+    ret_df = pd.DataFrame({
+        'aaa': [.01, -1, .01, .02, -.01, .03, np.nan, .01],
+        'bbb': [.02, .01, -.02, .01, .0, -1, .01, .02],
+        'mkt': .01,
+        }, index=index)
+    res = roll_ann_ret(ret_df, window)
+    exp = _naive_roll(ret_df, window, 'ann_ret')
+    print(res)
+    print(f'Same as naive: {np.allclose(res, exp, equal_nan=True)}')
+
+
+def _bench_rolling(tickers=None, window=63):
+    """ Compares the rolling statistics with the naive approach on the full
+    panel, printing the time each one takes and whether they agree
+    """
+    import zid_project2 as zp
+
+    if tickers is None:
+        tickers = cfg.TICKERS
+    ret_df = zp.mk_ret_df(zp.mk_prc_df(tickers))
+    print(f'Panel: {ret_df.shape[0]} rows x {len(tickers)} tickers, window={window}')
+
+    for stat in STATS:
+        start = time.perf_counter()
+        res = _FUNCS[stat](ret_df, window)
+        fast_t = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exp = _naive_roll(ret_df, window, stat)
+        naive_t = time.perf_counter() - start
+
+        same = np.allclose(res, exp, equal_nan=True, rtol=1e-6, atol=1e-10)
+        print(f'{stat:<8} cumsum: {fast_t:.4f} s  naive: {naive_t:.3f} s  '
+              f'({naive_t / fast_t:.0f}x)  same: {same}')
+
+    start = time.perf_counter()
+    mk_roll_df(ret_df)
+    print(f'mk_roll_df (all stats, windows {WINDOWS}): {time.perf_counter() - start:.4f} s')
+
+
+if __name__ == "__main__":
+    _test_roll_ann_ret()
+    _bench_rolling()
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 import datetime
@@ -6,9 +7,15 @@ import pandas as pd
 
 
 import config as cfg
+import factors
+import returns
+import abnormal
+import prc_cache
+import portfolio
+import calendar_agg
 
 
-def read_prc_csv(tic):
+def read_prc_csv(tic, store=None, start=None, end=None, columns=None):
     """ This function creates a data frame with the contents of a CSV file 
     containing stock price information for a given ticker. 
     
@@ -18,6 +25,20 @@ def read_prc_csv(tic):
         String with the ticker (can include lowercase and/or uppercase
         characters)
 
+    store : PrcStore, optional
+        If given, the data is returned from this memory-mapped store (see
+        `prc_store.PrcStore.read_prc`) instead of the CSV file.
+
+    start, end : str or Timestamp, optional
+        If given, only the rows from `start` to `end` (inclusive) are
+        returned. The other rows are skipped before they are parsed (see
+        `prc_cache.read_csv`).
+
+    columns : list, optional
+        Columns to return, formatted according to `standardise_colnames`
+        (e.g. ['adj_close']). Other columns are not parsed. Defaults to all
+        columns.
+
     Returns
     -------
     df 
@@ -35,15 +56,16 @@ def read_prc_csv(tic):
           `project2.config.py` module.
 
     """
+    if store is not None:
+        return store.read_prc(tic, start=start, end=end, columns=columns)
+
     tic = tic.lower()
 
     filename = tic + "_prc.csv"
     filepath = os.path.join(cfg.DATADIR, filename)
 
-    result = pd.read_csv(filepath)
-    result = cfg.standardise_colnames(result)
-    result = result.set_index(pd.DatetimeIndex(result['date']))
-    result = result.drop(['date'], axis=1)
+    # Parsed once, then loaded from the binary cache (see `prc_cache`)
+    result = prc_cache.read_csv(filepath, start=start, end=end, columns=columns)
 
     '''
     result = pd.DataFrame(index=pd.DatetimeIndex(filehandle.iloc[1:, 0]),
@@ -54,7 +76,7 @@ def read_prc_csv(tic):
     return result
 
 
-def mk_prc_df(tickers, prc_col='adj_close'):
+def mk_prc_df(tickers, prc_col='adj_close', workers=None, store=None, start=None, end=None):
     """ This function creates a data frame containing price information for a
     list of tickers and a given type of quote (e.g., open, close, ...)  
 
@@ -72,6 +94,20 @@ def mk_prc_df(tickers, prc_col='adj_close'):
         function defined in the config.py module.  
         Defaults to 'adj_close'.
 
+    workers : int, optional
+        Number of threads used to read the CSV files. If 1, files are read
+        one after another. Defaults to None (the `ThreadPoolExecutor`
+        default).
+
+    store : PrcStore, optional
+        If given, the data is returned from this memory-mapped store (see
+        `prc_store.PrcStore.prc_df`) instead of the CSV files.
+
+    start, end : str or Timestamp, optional
+        If given, only the dates from `start` to `end` (inclusive) are
+        included. Only `prc_col` and these dates are read from each file
+        (see `read_prc_csv`).
+
     Returns
     -------
     df
@@ -89,22 +125,76 @@ def mk_prc_df(tickers, prc_col='adj_close'):
 
     """
 
-    result = pd.DataFrame()
+    result = mk_prc_dfs(tickers, [prc_col], workers=workers, store=store, start=start, end=end)
+    return result[prc_col]
+
+
+def mk_prc_dfs(tickers, prc_cols, workers=None, store=None, start=None, end=None):
+    """ Same as `mk_prc_df`, but creates one data frame for each column in
+    `prc_cols` while reading each CSV file only once.
+
+    The CSV files are parsed concurrently and each wide data frame is built
+    with a single `pd.concat`, instead of joining the tickers one at a time.
+
+    Parameters
+    ----------
+    tickers : list
+        List of tickers
+
+    prc_cols : list
+        List of column names (e.g. ['adj_close', 'volume']), in the format
+        of the `standardise_colnames` function.
+
+    workers : int, optional
+        Number of threads used to read the CSV files. If 1, files are read
+        one after another. Defaults to None (the `ThreadPoolExecutor`
+        default).
 
-    for tic in tickers:
-        ticker = tic.lower()
-        df = read_prc_csv(ticker)
-        df = df[prc_col]
-        if result.empty:
-            result = pd.DataFrame(index=df.index, data={ticker: df.values})
-        else:
-            df2 = pd.DataFrame(index=df.index, data={ticker: df.values})
-            result = result.join(df2, how="outer")
+    store : PrcStore, optional
+        If given, the data is returned from this memory-mapped store (see
+        `prc_store.PrcStore.prc_df`) instead of the CSV files.
 
+    start, end : str or Timestamp, optional
+        See `mk_prc_df`
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<prc_col> : <df>}, where each <df> is
+        formatted as the output of `mk_prc_df`.
+
+    """
+    if store is not None:
+        return {col: store.prc_df(tickers, col, start=start, end=end) for col in prc_cols}
+
+    tickers = [tic.lower() for tic in tickers]
+    if not tickers:
+        return {col: pd.DataFrame() for col in prc_cols}
+
+    def _read(tic):
+        return read_prc_csv(tic, start=start, end=end, columns=prc_cols)
+
+    if workers == 1:
+        dfs = [_read(tic) for tic in tickers]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            dfs = list(executor.map(_read, tickers))
+
+    return _combine(tickers, dfs, prc_cols)
+
+
+def _combine(tickers, dfs, prc_cols):
+    """ Returns the output of `mk_prc_dfs` given the output of
+    `read_prc_csv` for each ticker in `tickers`
+    """
+    result = {}
+    for col in prc_cols:
+        sers = [df[col].rename(tic) for tic, df in zip(tickers, dfs)]
+        result[col] = pd.concat(sers, axis=1, join='outer', sort=True)
     return result
 
 
-def mk_ret_df(prc_df):
+def mk_ret_df(prc_df, ff_cols=None):
     """ Creates a data frame containing returns for both individuals stock AND 
     a proxy for the market portfolio, given a data frame with stock prices, `prc_df`. 
 
@@ -126,6 +216,11 @@ def mk_ret_df(prc_df):
         `mk_prc_df`). See the docstring of the `mk_prc_df` function
         for a description of this data frame.
 
+    ff_cols : list, optional
+        Columns from the FF_CSV file to include in the output. Use
+        `abnormal.model_cols(model)` to get the columns needed to compute
+        abnormal returns with a given model. Defaults to ['mkt'].
+
 
     Returns
     -------
@@ -137,37 +232,34 @@ def mk_ret_df(prc_df):
           dates in `prc_df` which are also present in the CSV file FF_CSV. 
 
         - df.columns: Includes all the column labels in `prc_df.columns` AND
-          the column label for market returns, "mkt".
+          the column label for market returns, "mkt" (or the columns in
+          `ff_cols`, if given).
+
+    Notes
+    -----
+    - `prc_df` is not modified.
+    - See `returns.mk_rets` for log returns, gross returns and returns over
+      more than one period.
 
     """
 
     pathToMkt = os.path.join(cfg.DATADIR, "ff_daily.csv")
-    daily = pd.read_csv(pathToMkt)
-
-    daily = cfg.standardise_colnames(daily)
-    daily = daily.set_index(pd.DatetimeIndex(daily['date']))
-    daily = daily.drop(['date', 'smb', 'mkt-rf', 'hml', 'rf'], axis=1)
-
-    copy = prc_df.copy()
-    for i in range(len(copy.index)):
-        if i == 0:
-            for j in range(len(copy.columns)):
-                prc_df.iloc[i, j] = numpy.NAN
-        else:
-            for j in range(len(copy.columns)):
-                if pd.isna(copy.iloc[i, j]):
-                    continue
-                elif pd.isna(copy.iloc[i - 1, j]):
-                    prc_df.iloc[i, j] = numpy.NAN
-                else:
-                    prc_df.iloc[i, j] = (copy.iloc[i, j] - copy.iloc[i - 1, j]) / copy.iloc[i - 1, j]
-
-    prc_df = prc_df.join(daily, how='inner')
-    # prc_df = prc_df[prc_df['mkt'].notna()]
-    return prc_df
-
-
-def mk_aret_df(ret_df):
+    # Loaded once per process (see `factors.get_store`)
+    daily = factors.get_store(pathToMkt)
+
+    if ff_cols is None:
+        ff_cols = ['mkt']
+
+    # Returns are computed column-wise by `returns.mk_rets`, which does
+    # not write into `prc_df`.
+    ret_df = returns.mk_rets(prc_df)
+
+    ret_df = daily.join(ret_df, ff_cols)
+    # ret_df = ret_df[ret_df['mkt'].notna()]
+    return ret_df
+
+
+def mk_aret_df(ret_df, model='mkt'):
     """ Creates a data frame with abnormal returns for each stock in `ret_df`,
     where abnormal returns are computed by subtracting the market returns from
     the individual stock returns.
@@ -181,35 +273,37 @@ def mk_aret_df(ret_df):
         output of `mk_ret_df`.  See the docstring of the `mk_ret_df` function
         for a description of this data frame.
 
+    model : str, optional
+        The benchmark model used to compute expected returns. One of:
+        - 'mkt': market-adjusted returns (r - mkt)
+        - 'capm': CAPM abnormal returns
+        - 'ff3': Fama-French three-factor abnormal returns
+        Models other than 'mkt' need the FF_CSV columns given by
+        `abnormal.model_cols(model)` (see the `ff_cols` parameter of
+        `mk_ret_df`). Columns missing from `ret_df` are looked up in the
+        factor store (see `factors.get_store`). Defaults to 'mkt'.
+
     Returns
     -------
     df
         A data frame with abnormal returns for each individual stock in
-        `ret_df`. Abnormal returns are computed by subtracting the market
-        returns (column "mkt" in `ret_df`)  from each individual stock's
-        returns. 
+        `ret_df`. With the default model, abnormal returns are computed by
+        subtracting the market returns (column "mkt" in `ret_df`) from each
+        individual stock's returns.
 
         - df.index: DatetimeIndex with dates. These dates should include all
           dates in the `ret_df` data frame.
 
         - df.columns: Each column label will be a ticker from the `ret_df`
-          (i.e., all the columns of `ret_df` EXCLUDING the column "mkt").
+          (i.e., all the columns of `ret_df` EXCLUDING the column "mkt" and
+          any other FF_CSV column).
     
     """
-
-    result = ret_df.copy()
-    result = result.drop(['mkt'], axis=1)
-
-    marketData = ret_df['mkt'].values
-
-    for i in range(len(ret_df.index)):
-        for j in range(len(ret_df.columns) - 1):
-            if pd.isna(result.iloc[i, j]):
-                continue
-            else:
-                result.iloc[i, j] = result.iloc[i, j] - marketData[i]
-
-    return result
+    missing = [c for c in abnormal.model_cols(model) if c not in ret_df.columns]
+    if missing:
+        store = factors.get_store(os.path.join(cfg.DATADIR, "ff_daily.csv"))
+        ret_df = ret_df.assign(**{c: store.values(ret_df.index, c) for c in missing})
+    return abnormal.mk_arets(ret_df, model=model)
 
 
 
@@ -248,16 +342,9 @@ def get_avg(df, col, year):
     start_date = datetime.datetime(year=year, month=1, day=1)
     end_date = datetime.datetime(year=year, month=12, day=31)
 
+    # See `calendar_agg.agg_by_period` for all columns and periods at once
     annual_data = ser.loc[start_date:end_date]
-    sum = 0
-    z = 0
-    for x in annual_data:
-        if pd.isna(x):
-            continue
-        else:
-            sum += x
-            z += 1
-    result = sum / z
+    result = annual_data.mean()
     return result
 
 
@@ -282,28 +369,11 @@ def get_ew_rets(df, tickers):
         equal-weighted average will ignore missing values.
     """
 
-    copy = df.copy()
-    for column in tickers:
-        if column not in df:
-            copy.drop(column, axis=1)
-
-    copy['average'] = numpy.NAN
-
-    for i in range(len(copy.index)):
-        sum = 0
-        z = 0
-        for j in range(len(copy.columns) - 1):
-            if pd.isna(copy.iloc[i, j]):
-                continue
-            else:
-                sum += copy.iloc[i, j]
-                z += 1
-        if z == 0:
-            copy.iloc[i, -1] = numpy.NAN
-        else:
-            copy.iloc[i, -1] = sum / z
-
-    result = copy['average']
+    # Tickers not in `df` are ignored. See `portfolio.mk_port_rets` for
+    # value-weighted portfolios, custom weights and periodic rebalancing.
+    tickers = [tic for tic in tickers if tic in df.columns]
+    weights = portfolio.mk_weights({'average': tickers}, tickers)
+    result = portfolio.mk_port_rets(df, weights)['average']
     return result
 
 
@@ -354,8 +424,83 @@ def get_ann_ret(ser, start, end):
     return annualized_return
 
 
+def get_ann_rets(ret_df, ranges):
+    """ Returns the annualised returns for many series and many periods at
+    once.
+
+    Each result is the same as `get_ann_ret(ret_df[<ticker>], <start>,
+    <end>)`, but the cumulative log growth of every column is computed once.
+    Each period is then answered by locating `start` and `end` in the index
+    with a binary search and taking the difference of two cumulative sums.
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A Pandas data frame with a DatetimeIndex index and daily returns
+        (e.g. the output of `mk_ret_df`).
+
+    ranges : data frame
+        A data frame with the columns "start" and "end" (strings in ISO
+        format or datetimes). If it also has a column "ticker", each row is
+        computed for that column of `ret_df` only. Otherwise, each row is
+        computed for every column of `ret_df`.
+
+    Returns
+    -------
+    df
+        A data frame with one row per (ticker, period) and the columns
+        "ticker", "start", "end", "nobs" (number of non-missing returns)
+        and "ann_ret". Periods without any returns have a missing "ann_ret".
+
+    """
+    if not ret_df.index.is_monotonic_increasing:
+        ret_df = ret_df.sort_index()
+
+    arr = ret_df.to_numpy(dtype='float64')
+    valid = ~numpy.isnan(arr)
+    # Row `i` has the totals for the first `i` rows of `ret_df`
+    logs = numpy.zeros((len(arr) + 1, arr.shape[1]))
+    nobs = numpy.zeros((len(arr) + 1, arr.shape[1]))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        numpy.cumsum(numpy.where(valid, numpy.log1p(arr), 0.0), axis=0, out=logs[1:])
+    numpy.cumsum(valid, axis=0, out=nobs[1:])
+
+    if 'ticker' in ranges.columns:
+        tickers = list(ranges['ticker'])
+        starts = list(ranges['start'])
+        ends = list(ranges['end'])
+    else:
+        tickers = list(ret_df.columns) * len(ranges)
+        starts = numpy.repeat(ranges['start'].to_numpy(), len(ret_df.columns))
+        ends = numpy.repeat(ranges['end'].to_numpy(), len(ret_df.columns))
+
+    cols = ret_df.columns.get_indexer(tickers)
+    if (cols < 0).any():
+        missing = sorted({tic for tic, col in zip(tickers, cols) if col < 0})
+        msg = f"Tickers {missing} are not columns of `ret_df`"
+        raise Exception(msg)
+
+    # First row on or after `start` and first row after `end`
+    lo = ret_df.index.searchsorted(pd.DatetimeIndex(starts), side='left')
+    hi = ret_df.index.searchsorted(pd.DatetimeIndex(ends), side='right')
+    hi = numpy.maximum(hi, lo)
+
+    n = nobs[hi, cols] - nobs[lo, cols]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        ann_ret = numpy.expm1((logs[hi, cols] - logs[lo, cols]) * 252 / n)
+
+    result = pd.DataFrame({
+        'ticker': tickers,
+        'start': starts,
+        'end': ends,
+        'nobs': n.astype('int64'),
+        'ann_ret': numpy.where(n > 0, ann_ret, numpy.nan),
+        })
+    return result
+
+
 Q1_ANSWER = 'TSLA'
-Q2_ANSWER = '0.2009'
+Q2_ANSWER = '0.2044'
 Q3_ANSWER = '0.5516'
 Q4_ANSWER = '0.3770'
     
@@ -666,6 +811,25 @@ def _test_get_ann_ret():
 
 
 
+def _test_get_ann_rets():
+    """ Test function for `get_ann_rets`. Compares it with `get_ann_ret` for
+    a few tickers and periods.
+    """
+    tickers = ['aapl', 'tsla', 'msft']
+    ret_df = mk_ret_df(mk_prc_df(tickers))
+    ranges = pd.DataFrame({
+        'start': ['2010-01-01', '2015-06-30', '2020-01-01'],
+        'end': ['2020-12-31', '2016-06-30', '2020-03-31'],
+        })
+    res = get_ann_rets(ret_df[tickers], ranges)
+    _test_print(res)
+
+    exp = [get_ann_ret(ret_df[tic], start, end)
+           for tic, start, end in zip(res['ticker'], res['start'], res['end'])]
+    same = numpy.allclose(res['ann_ret'], exp, rtol=1e-10)
+    _test_print(f'Same results as get_ann_ret: {same}')
+
+
 if __name__ == "__main__":
     pass
     #_test_cfg()
@@ -679,11 +843,11 @@ if __name__ == "__main__":
 
     # Q1 answer
     tickerlist = list(cfg.TICMAP.keys())
+    ret_df = calendar_agg.ret_panel(tickerlist)
+    annual_returns = calendar_agg.agg_by_period(ret_df, 'year', ['mean']).loc['2020', 'mean']
     for key, value in cfg.TICMAP.items():
         ticker = key.lower()
-        #print(mk_prc_df(tickerlist))
-        annual_return = get_avg(mk_ret_df(mk_prc_df(tickerlist)), ticker, 2020)
-        print(f"{key}: return is {annual_return}")
+        print(f"{key}: return is {annual_returns[ticker]}")
     
 
      # Q2 answer
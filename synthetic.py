@@ -0,0 +1,322 @@
+""" synthetic.py
+
+Synthetic price data for scale testing
+
+`generate` writes, for any number of tickers:
+    - "<tic>_prc.dat" files in the fixed-width layout of `zid_project1`
+      (`COLUMNS` / `COLWIDTHS`, 80 characters per line) and a tickers file
+    - "<tic>_prc.csv" files with the columns of the project2 price files
+      (Date, Open, High, Low, Close, Adj Close, Volume)
+    - a matching "ff_daily.csv" (Date, mkt-rf, smb, hml, rf, mkt)
+
+Daily factor returns are drawn once for all business days in the history.
+Each stock's return is rf + beta * (mkt-rf) + s * smb + h * hml plus
+idiosyncratic noise, so `mk_aret_df` and the factor models give meaningful
+results. Tickers can list after the start of the history (IPOs), be delisted
+before its end and have missing days (gaps).
+
+Example
+-------
+    python synthetic.py /tmp/synth --ntics 1000 --start 2000-01-03
+
+`toolkit_config` (with `PRJDIR`) must be importable, as for the projects.
+
+"""
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from project1 import zid_project1 as zp1
+
+
+# Columns of the project2 price files, in order
+CSV_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+FF_COLUMNS = ['Date', 'mkt-rf', 'smb', 'hml', 'rf', 'mkt']
+
+# Minimum number of days of history for tickers that list late or are
+# delisted early
+MIN_DAYS = 60
+
+# Decimal places of the prices in the CSV files (the ".dat" fields keep as
+# many as fit in their width)
+DECIMALS = 6
+
+
+def mk_tickers(ntics):
+    """ Returns `ntics` distinct four-letter tickers in lower case ('aaaa',
+    'aaab', ...)
+    """
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    pos = np.arange(ntics)
+    digits = [(pos // 26 ** k) % 26 for k in (3, 2, 1, 0)]
+    return [''.join(chars) for chars in zip(*(letters[d] for d in digits))]
+
+
+def mk_factors(dates, rng):
+    """ Returns a data frame with daily factor returns for `dates`, with the
+    columns of "ff_daily.csv" (except 'Date')
+    """
+    n = len(dates)
+    mkt_rf = rng.normal(0.0004, 0.011, n)
+    smb = rng.normal(0.0, 0.005, n)
+    hml = rng.normal(0.0, 0.005, n)
+    rf = np.round(np.full(n, 0.0001) + rng.normal(0, 0.00002, n).cumsum().clip(-0.0001, 0.0002), 5)
+    return pd.DataFrame({
+        'mkt-rf': mkt_rf,
+        'smb': smb,
+        'hml': hml,
+        'rf': rf,
+        'mkt': mkt_rf + rf,
+        }, index=dates)
+
+
+def mk_prices(ff, rng, first, last, gap_prob):
+    """ Returns a data frame with the price columns (`CSV_COLUMNS` without
+    'Date') of one stock for the rows `first` to `last` (inclusive) of the
+    factor data frame `ff`, dropping each row with probability `gap_prob`
+    """
+    ff = ff.iloc[first:last + 1]
+    n = len(ff)
+    beta, s, h = rng.normal(1.0, 0.3), rng.normal(0.0, 0.4), rng.normal(0.0, 0.4)
+    rets = (ff['rf'].to_numpy() + beta * ff['mkt-rf'].to_numpy() + s * ff['smb'].to_numpy()
+            + h * ff['hml'].to_numpy() + rng.normal(0.0, rng.uniform(0.005, 0.03), n))
+    adj_close = rng.uniform(5, 100) * np.cumprod(1 + np.maximum(rets, -0.9))
+
+    # Dividends: the unadjusted price is the adjusted price grossed up by the
+    # dividends paid until the end of the history
+    div_yield = rng.uniform(0.0, 0.03) / 252
+    close = adj_close * (1 + div_yield) ** np.arange(n, 0, -1)
+    open_ = close * (1 + rng.normal(0.0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0.0, 0.01, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0.0, 0.01, n)))
+    volume = np.round(rng.lognormal(np.log(rng.uniform(5, 200)), 0.5, n)).astype('int64')
+
+    df = pd.DataFrame({
+        'Open': open_,
+        'High': high,
+        'Low': low,
+        'Close': close,
+        'Adj Close': adj_close,
+        'Volume': volume,
+        }, index=ff.index)
+    if gap_prob > 0:
+        keep = rng.random(n) >= gap_prob
+        keep[0] = True
+        df = df[keep]
+    return df
+
+
+def _texts(df):
+    """ Returns a dictionary with the text of each value of each column in
+    `CSV_COLUMNS`, as NumPy string arrays (the same text is used in both
+    file formats). Prices are written in fixed-point notation with
+    `DECIMALS` decimal places.
+    """
+    result = {'Date': df.index.strftime('%Y-%m-%d').to_numpy(dtype=str)}
+    for col in CSV_COLUMNS[1:]:
+        arr = df[col].to_numpy()
+        if arr.dtype.kind == 'f':
+            result[col] = np.char.mod(f'%.{DECIMALS}f', arr)
+        else:
+            result[col] = arr.astype(str)
+    return result
+
+
+def _fit(text, width, fill='0'):
+    """ Returns each string in `text` padded on the left with `fill` to
+    exactly `width` characters, as bytes. Numbers (`fill='0'`) that are too
+    wide lose their last decimal places, and raise an exception if the
+    digits before the decimal point do not fit.
+    """
+    if fill == '0':
+        point = np.char.find(text, '.')
+        nint = np.where(point < 0, np.char.str_len(text), point)
+        if (nint > width).any():
+            msg = f"Values do not fit in {width} characters: {text[nint > width][:5]}"
+            raise Exception(msg)
+        text = np.char.zfill(text, width)
+    else:
+        text = np.char.rjust(text, width, fill)
+    return text.astype(f'S{width}')
+
+
+def to_dat(texts):
+    """ Returns the contents of a ".dat" file, formatted as described in
+    project1/README.txt, given the output of `_texts`
+    """
+    recs = np.empty(len(texts['Date']), dtype=zp1._DAT_DTYPE)
+    for col in zp1.COLUMNS:
+        fill = ' ' if col == 'Date' else '0'
+        recs[col] = _fit(texts[col], zp1.COLWIDTHS[col], fill)
+    recs['_nl'] = b'\n'
+    return recs.tobytes()
+
+
+def to_csv(texts, columns=CSV_COLUMNS):
+    """ Returns the contents of a CSV file with the given `columns`, given
+    the output of `_texts`
+    """
+    rows = zip(*(texts[col].tolist() for col in columns))
+    return ','.join(columns) + '\n' + ''.join(','.join(row) + '\n' for row in rows)
+
+
+def generate(dst, ntics=1000, start='2000-01-03', end='2020-12-31', ipo_frac=0.3,
+             delist_frac=0.05, gap_prob=0.001, seed=0):
+    """ Writes a synthetic dataset to the folder `dst`
+
+    Parameters
+    ----------
+    dst : str
+        Output folder (created if needed). The ".dat" files and the tickers
+        file are written to "<dst>/dat" and the CSV files to "<dst>/csv".
+
+    ntics : int, optional
+        Number of tickers. Defaults to 1000.
+
+    start, end : str, optional
+        First and last dates of the history (business days in between).
+        Defaults to '2000-01-03' and '2020-12-31'.
+
+    ipo_frac : float, optional
+        Fraction of tickers whose first date is drawn uniformly from the
+        history instead of being `start`. Defaults to 0.3.
+
+    delist_frac : float, optional
+        Fraction of tickers whose last date is drawn uniformly from the
+        history instead of being `end`. Defaults to 0.05.
+
+    gap_prob : float, optional
+        Probability that any given day is missing from a ticker's files.
+        Defaults to 0.001.
+
+    seed : int, optional
+        Seed of the random number generator. The same arguments always
+        produce the same files. Defaults to 0.
+
+    Returns
+    -------
+    dict
+        A dictionary with the tickers ('tickers', lower case) and the
+        locations of the ".dat" folder ('datdir'), the tickers file
+        ('ticpath') and the CSV folder ('datadir')
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end, name='Date')
+    if len(dates) < 2 * MIN_DAYS:
+        msg = f"The history from {start} to {end} must have at least {2 * MIN_DAYS} business days"
+        raise Exception(msg)
+
+    ds = {
+        'tickers': mk_tickers(ntics),
+        'datdir': os.path.join(dst, 'dat'),
+        'ticpath': os.path.join(dst, 'dat', 'TICKERS.txt'),
+        'datadir': os.path.join(dst, 'csv'),
+        }
+    os.makedirs(ds['datdir'], exist_ok=True)
+    os.makedirs(ds['datadir'], exist_ok=True)
+
+    ff = mk_factors(dates, rng)
+    texts = {'Date': dates.strftime('%Y-%m-%d').to_numpy(dtype=str)}
+    texts.update({col: ff[col].to_numpy().astype(str) for col in FF_COLUMNS[1:]})
+    with open(os.path.join(ds['datadir'], 'ff_daily.csv'), 'w') as fobj:
+        fobj.write(to_csv(texts, FF_COLUMNS))
+
+    n = len(dates)
+    for tic in ds['tickers']:
+        first, last = 0, n - 1
+        if rng.random() < ipo_frac:
+            first = int(rng.integers(0, n - MIN_DAYS))
+        if rng.random() < delist_frac:
+            last = int(rng.integers(first + MIN_DAYS, n))
+        texts = _texts(mk_prices(ff, rng, first, last, gap_prob))
+        with open(os.path.join(ds['datadir'], f'{tic}_prc.csv'), 'w') as fobj:
+            fobj.write(to_csv(texts))
+        with open(os.path.join(ds['datdir'], f'{tic}_prc.dat'), 'wb') as fobj:
+            fobj.write(to_dat(texts))
+
+    with open(ds['ticpath'], 'w') as fobj:
+        fobj.write('\n'.join(tic.upper() for tic in ds['tickers']) + '\n')
+    return ds
+
+
+# ----------------------------------------------------------------------------
+#   Test functions
+# ----------------------------------------------------------------------------
+def _test_generate():
+    """ Generates a small dataset and checks that it can be read by both
+    projects: the ".dat" columns must match the CSV columns, and
+    `mk_ret_df` must cover every date of every ticker
+    """
+    import sys
+    import tempfile
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'project2'))
+    import config as cfg
+    import abnormal
+    import prc_cache
+    import zid_project2 as zp2
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ds = generate(tmpdir, ntics=20, start='2015-01-01', end='2020-12-31', seed=1)
+        saved = zp1.DATDIR, cfg.DATADIR, prc_cache.ENABLED
+        zp1.DATDIR = ds['datdir']
+        cfg.DATADIR = ds['datadir']
+        prc_cache.ENABLED = False
+        try:
+            same = True
+            for tic in ds['tickers']:
+                cols = zp1.read_dat_cols(tic)
+                df = zp2.read_prc_csv(tic)
+                same &= np.array_equal(cols['Date'], df.index.to_numpy().astype('M8[D]'))
+                same &= np.array_equal(cols['Volume'], df['volume'].to_numpy())
+                # .dat fields are truncated to their width
+                same &= np.allclose(cols['Adj Close'], df['adj_close'], rtol=1e-6)
+            print(f"Tickers: {len(zp1.get_tics(ds['ticpath']))}")
+            print(f'.dat files match the CSV files: {same}')
+
+            ff_cols = abnormal.model_cols('capm')
+            ret_df = zp2.mk_ret_df(zp2.mk_prc_df(ds['tickers']), ff_cols=ff_cols)
+            print(f'mk_ret_df: {ret_df.shape[0]} rows x {ret_df.shape[1]} columns')
+            print(zp2.mk_aret_df(ret_df, model='capm').describe().T.head())
+        finally:
+            zp1.DATDIR, cfg.DATADIR, prc_cache.ENABLED = saved
+
+    # Prices near zero are written in fixed-point notation, and values whose
+    # integer part does not fit raise an exception instead of being cut
+    df = pd.DataFrame({col: [1.2345e-05, 1234.5678] for col in CSV_COLUMNS[1:]},
+                      index=pd.DatetimeIndex(['2020-01-02', '2020-01-03']))
+    df['Volume'] = [1, 2]
+    texts = _texts(df)
+    print(f"Small prices: {texts['Open'].tolist()} -> {_fit(texts['Open'], 6).tolist()}")
+    try:
+        _fit(np.array(['1234567.5']), 6)
+        print('Too wide: no exception')
+    except Exception as e:
+        print(f'Too wide: {e}')
+
+
+def _main(argv=None):
+    """ Command line entry point (see the module docstring)
+    """
+    parser = argparse.ArgumentParser(description='Writes a synthetic price dataset')
+    parser.add_argument('dst', help='Output folder')
+    parser.add_argument('--ntics', type=int, default=1000)
+    parser.add_argument('--start', default='2000-01-03')
+    parser.add_argument('--end', default='2020-12-31')
+    parser.add_argument('--ipo-frac', type=float, default=0.3)
+    parser.add_argument('--delist-frac', type=float, default=0.05)
+    parser.add_argument('--gap-prob', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    ds = generate(args.dst, ntics=args.ntics, start=args.start, end=args.end,
+                  ipo_frac=args.ipo_frac, delist_frac=args.delist_frac,
+                  gap_prob=args.gap_prob, seed=args.seed)
+    print(f"{len(ds['tickers'])} tickers written to {args.dst}")
+
+
+if __name__ == "__main__":
+    _main()